@@ -0,0 +1,44 @@
+"""
+Per request cost of authenticating with plaintext and with encrypted shared
+secrets. The decrypted secret is cached, so both should be close.
+
+    $ PYTHONPATH=. python benchmarks/bench_encryption.py [iterations]
+"""
+import sys
+from timeit import timeit
+
+from atlassian_jwt import encode_token
+from flask import Flask
+from flask_atlassian_connect import AtlassianConnect, AtlassianConnectClient
+from flask_atlassian_connect.encryption import generate_key
+
+CLIENT_KEY = 'bench-client'
+SECRET = 'bench-shared-secret-0123456789abcdef'
+URL = '/atlassian_connect/webpanel/userPanel?issueKey=TEST-1'
+
+
+def _addon(secret_keys):
+    app = Flask(__name__)
+    app.config['ADDON_SECRET_KEYS'] = secret_keys
+    addon = AtlassianConnect(app)
+    addon._save_client(AtlassianConnectClient(
+        clientKey=CLIENT_KEY, sharedSecret=SECRET,
+        baseUrl='https://bench.atlassian.net'))
+    return app, addon
+
+
+def main(iterations=20000):
+    headers = {'Authorization': 'JWT ' + encode_token(
+        'GET', URL, CLIENT_KEY, SECRET)}
+    for name, secret_keys in [('plaintext', None), ('encrypted', [generate_key()])]:
+        app, addon = _addon(secret_keys)
+        with app.test_request_context(URL):
+            func = lambda: addon.auth.verify('GET', URL, headers)
+            func()
+            elapsed = min(timeit(func, number=iterations) for _ in range(3))
+        print("%-10s %8.2f us/request %10.0f requests/s" % (
+            name, elapsed * 1e6 / iterations, iterations / elapsed))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:2]])
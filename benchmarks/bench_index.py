@@ -0,0 +1,41 @@
+"""
+Finding the tenant for a product url among many: a scan over
+client_class.all() versus the TenantIndex.
+
+    $ PYTHONPATH=. python benchmarks/bench_index.py [tenants]
+"""
+import sys
+import tracemalloc
+from timeit import timeit
+
+from flask_atlassian_connect import AtlassianConnectClient
+from flask_atlassian_connect.index import TenantIndex
+
+
+def main(tenants=100000):
+    clients = [AtlassianConnectClient(
+        clientKey='client-%06d' % n, productType=('jira', 'confluence')[n % 2],
+        baseUrl='https://tenant%06d.atlassian.net%s' % (n, ('', '/wiki')[n % 2]))
+        for n in range(tenants)]
+    url = 'https://tenant%06d.atlassian.net/browse/TEST-1' % (tenants - 2)
+
+    def scan():
+        for client in clients:
+            if url.startswith(client.baseUrl + '/'):
+                return client.clientKey
+
+    tracemalloc.start()
+    index = TenantIndex()
+    index.rebuild(clients)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert scan() == index.lookup(url)
+
+    for name, func, number in [('scan', scan, 10), ('index', lambda: index.lookup(url), 100000)]:
+        elapsed = min(timeit(func, number=number) for _ in range(3))
+        print("%-6s %12.2f us/lookup" % (name, elapsed * 1e6 / number))
+    print("index  %12.1f bytes/tenant" % (float(size) / tenants))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:2]])
@@ -0,0 +1,62 @@
+"""
+Throughput of a CPU bound webhook run in request threads versus on the
+process pool, with several requests in flight.
+
+    $ PYTHONPATH=. python benchmarks/bench_offload.py [requests] [threads]
+"""
+import json
+import os
+import sys
+import threading
+from time import perf_counter
+
+from atlassian_jwt import encode_token
+from flask import Flask
+from flask_atlassian_connect import AtlassianConnect, AtlassianConnectClient
+
+CLIENT_KEY = 'bench-client'
+SECRET = 'bench-shared-secret-0123456789abcdef'
+URL = '/atlassian_connect/webhook/jiraissue_updated'
+
+
+def issue_updated(client, event):
+    """Stand-in for diffing a large changelog"""
+    return str(sum(i * i for i in range(event['work'])))
+
+
+def _run(process_pool, requests, threads):
+    app = Flask(__name__)
+    addon = AtlassianConnect(app)
+    addon.webhook('jira:issue_updated', process_pool=process_pool)(issue_updated)
+    AtlassianConnectClient.save(AtlassianConnectClient(
+        clientKey=CLIENT_KEY, sharedSecret=SECRET))
+    headers = {'Authorization': 'JWT ' + encode_token('POST', URL, CLIENT_KEY, SECRET)}
+    body = json.dumps({'work': 300000})
+
+    def _worker(count):
+        client = app.test_client()
+        for _ in range(count):
+            client.post(URL, data=body, content_type='application/json',
+                        headers=headers)
+
+    if process_pool:
+        _worker(threads)  # start the worker processes before timing
+    workers = [threading.Thread(target=_worker, args=(requests // threads,))
+               for _ in range(threads)]
+    start = perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = perf_counter() - start
+    addon.shutdown()
+    return requests / elapsed
+
+
+def main(requests=80, threads=os.cpu_count()):
+    for name, process_pool in [('threads', False), ('process pool', True)]:
+        print("%-13s %8.1f requests/s" % (name, _run(process_pool, requests, threads)))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:3]])
@@ -0,0 +1,73 @@
+"""
+Request throughput with and without the sampling profiler. The threshold is
+set high so this measures sampling overhead, not writing profiles.
+
+    $ PYTHONPATH=. python benchmarks/bench_profiler.py [requests]
+"""
+import shutil
+import sys
+import tempfile
+import threading
+from time import perf_counter
+
+from atlassian_jwt import encode_token
+from flask import Flask
+from flask_atlassian_connect import AtlassianConnect, AtlassianConnectClient
+
+CLIENT_KEY = 'bench-client'
+SECRET = 'bench-shared-secret-0123456789abcdef'
+URL = '/atlassian_connect/webpanel/userPanel'
+THREADS = 4
+
+
+def user_panel(client):
+    """A few milliseconds of pure python, like a small template render"""
+    return str(sum(i * i for i in range(20000)))
+
+
+def _run(config, requests):
+    app = Flask(__name__)
+    app.config.update(config)
+    addon = AtlassianConnect(app)
+    addon.webpanel(key='userPanel')(user_panel)
+    AtlassianConnectClient.save(AtlassianConnectClient(
+        clientKey=CLIENT_KEY, sharedSecret=SECRET))
+    headers = {'Authorization': 'JWT ' + encode_token('GET', URL, CLIENT_KEY, SECRET)}
+
+    def _worker():
+        client = app.test_client()
+        for _ in range(requests // THREADS):
+            client.get(URL, headers=headers)
+
+    threads = [threading.Thread(target=_worker) for _ in range(THREADS)]
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = perf_counter() - start
+    addon.shutdown()
+    return requests / elapsed
+
+
+def main(requests=2000):
+    directory = tempfile.mkdtemp()
+    try:
+        cases = [
+            ('off', {}),
+            ('on', {'ADDON_PROFILE_DIR': directory, 'ADDON_PROFILE_THRESHOLD': 60}),
+        ]
+        # best of three, alternating to even out machine noise
+        results = {name: 0 for name, _ in cases}
+        for _ in range(3):
+            for name, config in cases:
+                results[name] = max(results[name], _run(config, requests))
+        for name, _ in cases:
+            print("profiler %-4s %8.0f requests/s" % (name, results[name]))
+        print("overhead     %7.1f%%" % (100 * (1 - results['on'] / results['off'])))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:2]])
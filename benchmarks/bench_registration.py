@@ -0,0 +1,59 @@
+"""
+Startup benchmark: register 10k webpanels/modules/webhooks
+
+Compares calling the decorators one at a time against
+AtlassianConnect.register_modules.
+
+    $ PYTHONPATH=. python benchmarks/bench_registration.py [count]
+"""
+import sys
+from timeit import default_timer
+
+from flask import Flask
+from flask_atlassian_connect import AtlassianConnect
+
+
+def handler(**kwargs):
+    del kwargs
+
+
+def _entries(count):
+    for i in range(count):
+        kind = ('webhook', 'module', 'webpanel')[i % 3]
+        if kind == 'webhook':
+            yield {"type": kind, "event": "jira:event_%d" % i, "handler": handler}
+        else:
+            yield {"type": kind, "key": "key-%d" % i, "name": "Name %d" % i,
+                   "handler": handler}
+
+
+def decorators(count):
+    ac = AtlassianConnect(Flask(__name__))
+    for entry in _entries(count):
+        entry = dict(entry)
+        kind = entry.pop('type')
+        func = entry.pop('handler')
+        getattr(ac, kind)(**entry)(func)
+    return ac
+
+
+def bulk(count):
+    ac = AtlassianConnect(Flask(__name__))
+    ac.register_modules(_entries(count))
+    return ac
+
+
+def main(count=10000):
+    for func in (decorators, bulk):
+        best = None
+        for _ in range(5):
+            start = default_timer()
+            func(count)
+            elapsed = default_timer() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print("%-12s %6d registrations: %8.2f ms (%.2f us each)" % (
+            func.__name__, count, best * 1000, best * 1e6 / count))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:2]])
@@ -0,0 +1,40 @@
+"""
+Per token cost of signing and verifying with PyJWT against a cached
+TokenContext for the same tenant. Verification is jwt.decode either way and
+is only here for reference.
+
+    $ PYTHONPATH=. python benchmarks/bench_tokens.py [iterations]
+"""
+import sys
+from timeit import timeit
+
+import jwt
+from atlassian_jwt import encode_token
+from flask_atlassian_connect.tokens import TokenContextCache
+
+CLIENT_KEY = 'bench-client'
+SECRET = 'bench-shared-secret-0123456789abcdef'
+URL = '/atlassian_connect/webpanel/userPanel?issueKey=TEST-1'
+
+
+def main(iterations=20000):
+    contexts = TokenContextCache()
+    token = encode_token('GET', URL, CLIENT_KEY, SECRET)
+    cases = [
+        ('sign    pyjwt', lambda: encode_token('GET', URL, CLIENT_KEY, SECRET)),
+        ('sign    context', lambda: contexts.get(
+            CLIENT_KEY, SECRET).encode_token('GET', URL)),
+        ('verify  pyjwt', lambda: jwt.decode(
+            token, SECRET, audience=CLIENT_KEY, algorithms=['HS256'])),
+        ('verify  context', lambda: contexts.get(
+            CLIENT_KEY, SECRET).decode(token, audience=CLIENT_KEY)),
+    ]
+    for name, func in cases:
+        func()
+        elapsed = min(timeit(func, number=iterations) for _ in range(3))
+        print("%-16s %8.2f us/token %10.0f tokens/s" % (
+            name, elapsed * 1e6 / iterations, iterations / elapsed))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:2]])
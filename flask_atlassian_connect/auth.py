@@ -0,0 +1,59 @@
+"""Request authentication, kept separate so atlassian_jwt is imported lazily"""
+from collections import namedtuple
+
+from atlassian_jwt import Authenticator, DecodeError
+from atlassian_jwt.url_utils import parse_query_params
+
+from .canonical import query_string_hash
+from .tokens import unverified_claims
+
+
+class _SimpleAuthenticator(Authenticator):
+    """Implementation of Authenticator for Atlassian"""
+    def __init__(self, addon, *args, **kwargs):
+        super(_SimpleAuthenticator, self).__init__(*args, **kwargs)
+        self.addon = addon
+
+    def get_shared_secret(self, client_key):
+        """ I actually don't fully understand this. Go see atlassian_jwt """
+        return self.addon.shared_secret(self._load_client(client_key))
+
+    def _load_client(self, client_key):
+        client = self.addon._load_client(client_key)
+        if client is None:
+            raise DecodeError('No client for ' + client_key)
+        return client
+
+    def authenticate(self, http_method, url, headers=None):
+        """
+        Same as :py:meth:`atlassian_jwt.Authenticator.authenticate`, but the
+        client is loaded once and kept, see :py:meth:`verify`
+        """
+        return self.verify(http_method, url, headers).client_key
+
+    def verify(self, http_method, url, headers=None):
+        """
+        Authenticate the request, keeping everything that was looked up on
+        the way so callers do not need to load the client or decode the
+        token again
+
+        :rtype: :py:class:`Verified`
+        """
+        token = self._get_token(
+            headers=headers,
+            query_params=parse_query_params(url))
+
+        claims = unverified_claims(token)
+        if claims.get('qsh') != query_string_hash(http_method, url):
+            raise DecodeError('qsh does not match')
+
+        client_key = claims['iss']
+        client = self._load_client(client_key)
+        claims = self.addon.token_contexts.get(
+            client_key, self.addon.shared_secret(client)
+        ).decode(token, audience=claims.get('aud'), leeway=self.leeway,
+                 algorithms=self.algorithms)
+        return Verified(client_key, client, claims, token)
+
+
+Verified = namedtuple('Verified', ['client_key', 'client', 'claims', 'token'])
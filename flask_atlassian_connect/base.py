@@ -1,35 +1,65 @@
+import atexit
+import copy
+import gzip
+import hashlib
+import json
 import re
-from functools import wraps
+import threading
+from functools import partial, wraps
+from urllib.parse import urlencode
 
-from atlassian_jwt import Authenticator, encode_token
-from flask import abort, current_app, jsonify, request, g, url_for
-from jwt import decode
-from jwt.exceptions import DecodeError
-from requests import get
+from flask import Response, abort, current_app, request, g, jsonify, url_for
+from .cache import LRUCache
+from .canonical import request_url
 from .client import AtlassianConnectClient
+from .context import TenantContext
+from .index import TenantIndex
+from .singleflight import SingleFlight
 
-try:
-    # python2
-    from urllib import urlencode
-except ImportError:
-    # python3
-    from urllib.parse import urlencode
+_MODULE_KEY_RE = re.compile(r"^[a-zA-Z0-9-]+$")
+_CONSUMER_KEY_RE = re.compile(r"<key>(.*)</key>")
+_CONSUMER_PUBLIC_KEY_RE = re.compile(r"<publicKey>(.*)</publicKey>")
+_HANDLER_OPTIONS = ('cache_ttl', 'cache_key', 'cache_size', 'max_concurrency',
+                    'process_pool')
 
 
-class _SimpleAuthenticator(Authenticator):
-    """Implementation of Authenticator for Atlassian"""
-    def __init__(self, addon, *args, **kwargs):
-        super(_SimpleAuthenticator, self).__init__(*args, **kwargs)
-        self.addon = addon
+def _overloaded():
+    """Response for requests that were shed"""
+    return '', 503, {'Retry-After': '1'}
 
-    def get_shared_secret(self, client_key):
-        """ I actually don't fully understand this. Go see atlassian_jwt """
-        client = self.addon.client_class.load(client_key)
-        if client is None:
-            raise Exception('No client for ' + client_key)
-        if isinstance(client, dict):
-            return client.get('sharedSecret')
-        return client.sharedSecret
+
+_BASE_URL = '\0ac-base-url\0'
+# base urls per descriptor version that compressed variants are kept for
+_DESCRIPTOR_BASE_URLS = 8
+_BASE_URL_JSON = json.dumps(_BASE_URL)[1:-1].encode('ascii')
+
+
+def _fill_base_url(parts, base_url):
+    """Serialized descriptor with the placeholder replaced by base_url"""
+    return json.dumps(base_url)[1:-1].encode('utf8').join(parts)
+
+
+def _own_response(ret):
+    """
+    A handler result that is safe to hand to one more caller, responses
+    are mutable so coalesced callers each get a copy
+    """
+    if isinstance(ret, Response):
+        return type(ret)(ret.get_data(), status=ret.status,
+                         headers=list(ret.headers))
+    return ret
+
+
+def _compressed_variants(body):
+    """body keyed by Content-Encoding, brotli only if it is installed"""
+    variants = {'identity': body, 'gzip': gzip.compress(body, 9)}
+    try:
+        import brotli
+    except ImportError:
+        pass
+    else:
+        variants['br'] = brotli.compress(body)
+    return variants
 
 
 class AtlassianConnect(object):
@@ -39,21 +69,94 @@ class AtlassianConnect(object):
 
     You will need to provide a Client class that
     contains load(id) and save(client) methods.
+
+    requests, jwt and atlassian_jwt are only imported the first time they
+    are needed, so importing this module stays cheap for short lived
+    processes.
     """
     def __init__(self, app=None, client_class=AtlassianConnectClient):
         self.app = app
 
+        self._descriptor_version = 0
         self.descriptor = {
             "authentication": {"type": "jwt"},
             "lifecycle": {},
             "links": {
             },
         }
-        if app is not None:
-            self.init_app(app)
         self.client_class = client_class
-        self.auth = _SimpleAuthenticator(addon=self)
+        self._auth = None
+        self._token_contexts = None
         self.sections = {}
+        self.profiles = {}
+        self._descriptor_cache = {}
+        self.executor = None
+        self.journal = None
+        self.secrets = None
+        self.store = None
+        self.section_limits = {}
+        self.profiler = None
+        self._process_pool = None
+        self._process_pool_lock = threading.Lock()
+        self.periodic_jobs = []
+        self.scheduler = None
+        self.tenants = TenantIndex()
+        self._installs = SingleFlight()
+        atexit.register(self.shutdown)
+        if app is not None:
+            self.init_app(app)
+
+    @property
+    def descriptor(self):
+        """
+        The descriptor dict. It is serialized once and cached, the cache is
+        dropped whenever something is registered or the dict is replaced.
+        Call :py:meth:`invalidate_descriptor` after changing it in place
+        once it may have been served.
+        """
+        return self._descriptor
+
+    @descriptor.setter
+    def descriptor(self, descriptor):
+        self._descriptor = descriptor
+        self.invalidate_descriptor()
+
+    def invalidate_descriptor(self):
+        """Serialize :py:attr:`descriptor` again on the next request for it"""
+        self._descriptor_version += 1
+
+    @property
+    def auth(self):
+        """Authenticator used to verify incoming requests, created on first use"""
+        if self._auth is None:
+            from .auth import _SimpleAuthenticator
+            self._auth = _SimpleAuthenticator(addon=self)
+        return self._auth
+
+    @property
+    def token_contexts(self):
+        """Per tenant JWT signing/verification contexts, created on first use"""
+        if self._token_contexts is None:
+            from .tokens import TokenContextCache
+            self._token_contexts = TokenContextCache()
+        return self._token_contexts
+
+    @property
+    def process_pool(self):
+        """
+        Worker processes for ``process_pool=True`` handlers, started on first
+        use and stopped by :py:meth:`shutdown`
+        """
+        with self._process_pool_lock:
+            if self._process_pool is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                config = (self.app or current_app).config
+                self._process_pool = ProcessPoolExecutor(
+                    max_workers=config.get('ADDON_PROCESS_WORKERS'),
+                    mp_context=multiprocessing.get_context(
+                        config.get('ADDON_PROCESS_START_METHOD', 'spawn')))
+            return self._process_pool
 
     def init_app(self, app):
         """
@@ -68,6 +171,11 @@ class AtlassianConnect(object):
 
         app.route('/atlassian_connect/descriptor',
                   methods=['GET'])(self._get_descriptor)
+        app.route('/atlassian_connect/descriptor/<profile>',
+                  methods=['GET'])(self._get_profile_descriptor)
+        if app.config.get('ADDON_HEALTH_ENDPOINT'):
+            app.route('/atlassian_connect/health',
+                      methods=['GET'])(self._health)
         app.route('/atlassian_connect/<section>/<name>',
                   methods=['GET', 'POST'])(self._handler_router)
         app.context_processor(self._atlassian_jwt_post_token)
@@ -84,33 +192,320 @@ class AtlassianConnect(object):
             },
         }
         self.descriptor.update(app_descriptor)
+        for name, profile in app.config.get(
+                'ADDON_DESCRIPTOR_PROFILES', {}).items():
+            self.descriptor_profile(name, **profile)
+        self.invalidate_descriptor()
+
+        if app.config.get('ADDON_TENANT_WORKERS'):
+            from .executor import TenantExecutor
+            self.executor = TenantExecutor(
+                workers=app.config['ADDON_TENANT_WORKERS'],
+                queue_limit=app.config.get('ADDON_TENANT_QUEUE_LIMIT', 100),
+                weights=app.config.get('ADDON_TENANT_WEIGHTS'))
+
+        if app.config.get('ADDON_SECTION_CONCURRENCY'):
+            from .limits import ConcurrencyLimit
+            # lifecycle callbacks are never shed, Atlassian treats a failed
+            # one as a failed install
+            self.section_limits = {
+                section: ConcurrencyLimit(limit) for section, limit
+                in app.config['ADDON_SECTION_CONCURRENCY'].items()
+                if section != 'lifecycle'}
+
+        if app.config.get('ADDON_PROFILE_DIR'):
+            from .profiler import SamplingProfiler
+            self.profiler = SamplingProfiler(
+                app.config['ADDON_PROFILE_DIR'],
+                threshold=app.config.get('ADDON_PROFILE_THRESHOLD', 1.0),
+                interval=app.config.get('ADDON_PROFILE_INTERVAL', 0.01),
+                keep=app.config.get('ADDON_PROFILE_KEEP', 100))
+
+        if app.config.get('ADDON_STORE_TIMEOUT'):
+            from .store import StoreGuard
+            self.store = StoreGuard(
+                self.client_class,
+                timeout=app.config['ADDON_STORE_TIMEOUT'],
+                failure_threshold=app.config.get('ADDON_STORE_FAILURE_THRESHOLD', 5),
+                reset_timeout=app.config.get('ADDON_STORE_RESET_TIMEOUT', 30))
+
+        if app.config.get('ADDON_SECRET_KEYS'):
+            from .encryption import SecretBox
+            self.secrets = SecretBox(app.config['ADDON_SECRET_KEYS'])
+
+        if app.config.get('ADDON_LIFECYCLE_JOURNAL'):
+            from .journal import LifecycleJournal
+            self.journal = LifecycleJournal(
+                app.config['ADDON_LIFECYCLE_JOURNAL'],
+                apply=partial(self._apply_lifecycle_event, app))
+
+    def shutdown(self):
+        """Stop any background workers started by this addon, also run at exit"""
+        if self.executor is not None:
+            self.executor.shutdown()
+        if self.journal is not None:
+            self.journal.close()
+        if self.store is not None:
+            self.store.shutdown()
+        if self.profiler is not None:
+            self.profiler.stop()
+        with self._process_pool_lock:
+            pool, self._process_pool = self._process_pool, None
+        if pool is not None:
+            pool.shutdown()
+        if self.scheduler is not None:
+            self.scheduler.stop()
+            self.scheduler = None
+
+    def _health(self):
+        """Client store state and latency, if ``ADDON_STORE_TIMEOUT`` is set"""
+        store = self.store and self.store.health()
+        status = 'degraded' if store and store['state'] != 'closed' else 'ok'
+        return jsonify(status=status, store=store)
 
     def _atlassian_jwt_post_token(self):
         if not getattr(g, 'ac_client', None):
             return dict()
 
-        args = request.args.copy()
-        try:
-            del args['jwt']
-        except KeyError:
-            pass
-
-        signature = encode_token(
-            'POST',
-            request.path + '?' + urlencode(args),
-            g.ac_client.clientKey,
-            g.ac_client.sharedSecret)
-        args['jwt'] = signature
-        return dict(atlassian_jwt_post_url=request.path + '?' + urlencode(args))
+        url = request.path
+        args = [(k, v) for k, v in request.args.items(multi=True) if k != 'jwt']
+        if args:
+            url += '?' + urlencode(args)
+        return dict(
+            ac_context=self.context,
+            atlassian_jwt_post_url=self.sign_url(url, method='POST'),
+            atlassian_jwt_sign_url=self.sign_url,
+            atlassian_jwt_sign_urls=self.sign_urls)
+
+    @property
+    def context(self):
+        """
+        :py:class:`TenantContext` of the current request, or None outside
+        of webhook, module and webpanel handlers
+        """
+        return getattr(g, 'ac_context', None)
+
+    def sign_url(self, url, method='GET', expires_in=60 * 60, client=None):
+        """
+        Add a ``jwt`` parameter to url so it can be requested as the
+        current client. See :py:meth:`sign_urls`
+
+        Also available in templates as ``atlassian_jwt_sign_url``::
+
+            <a href="{{ atlassian_jwt_sign_url('/atlassian_connect/module/configurePage') }}">
+
+        :rtype: string
+        """
+        return self.sign_urls([(method, url)], expires_in, client)[0]
+
+    def sign_urls(self, urls, expires_in=60 * 60, client=None):
+        """
+        Sign many urls for the current client (``g.ac_client``) in one go.
+
+        Urls relative to the addon are signed as is, for the client. Urls
+        starting with the client's baseUrl are signed relative to it and
+        issued by the addon key, so they can be used against the product.
+        Results are cached for the rest of the request.
+
+        Example::
+
+            ac.sign_urls(['/atlassian_connect/module/configurePage',
+                          ('POST', '/atlassian_connect/module/save')])
+
+        :param urls:
+            Urls to sign, either a url (for GET) or a (method, url) pair
+        :type urls: list
+
+        :param expires_in:
+            Seconds until the signatures expire
+        :type expires_in: int
+
+        :param client:
+            Client to sign as, defaults to the one for the current request
+        :rtype: list
+        """
+        context = self.context
+        client = client or getattr(g, 'ac_client', None)
+        if client is None:
+            raise ValueError('No client to sign urls for')
+        if context is None or context.client is not client:
+            context = TenantContext(self, client, client.clientKey)
+        base_url = context.base_url
+        cache = g.setdefault('_ac_signed_urls', {})
+
+        keys = []
+        addon, product = [], []
+        for entry in urls:
+            method, url = ('GET', entry) if isinstance(entry, str) else entry
+            key = (client.clientKey, method.upper(), url, expires_in)
+            keys.append(key)
+            if key not in cache:
+                if base_url and url.startswith(base_url):
+                    product.append((key, method, url[len(base_url):] or '/'))
+                else:
+                    addon.append((key, method, url))
+
+        for missing, issuer in ((addon, None), (product, self.descriptor.get('key'))):
+            if not missing:
+                continue
+            if product is missing and issuer is None:
+                raise ValueError('The descriptor needs a key to sign product urls')
+            tokens = context.token_context.encode_tokens(
+                [(m, u) for _, m, u in missing], expires_in, issuer=issuer)
+            for (key, _, _), token in zip(missing, tokens):
+                url = key[2]
+                cache[key] = url + ('&' if '?' in url else '?') + 'jwt=' + token
+        return [cache[key] for key in keys]
+
+    def descriptor_profile(self, name, modules=None, **overrides):
+        """
+        Serve another variant of the descriptor from the same app at
+        /atlassian_connect/descriptor/<name>, eg one per product or per
+        environment. All variants share the same handlers and clients.
+
+        Example::
+
+            ac.descriptor_profile(
+                "confluence", key="my-addon-confluence",
+                scopes=["READ", "WRITE"], modules=["configurePage"])
+
+        Profiles can also be set up with the ``ADDON_DESCRIPTOR_PROFILES``
+        config, a dict of name to the arguments of this method.
+
+        :param name:
+            Url safe name of the profile
+        :type name: string
+
+        :param modules:
+            Module keys (and webhook events) to include, defaults to all
+        :type modules: list
+
+        :param overrides:
+            Top level descriptor values to replace (key, name, scopes, etc)
+        """
+        self.profiles[name] = (
+            overrides, None if modules is None else frozenset(modules))
+        self.invalidate_descriptor()
 
     def _get_descriptor(self):
         """Output atlassian connector descriptor file"""
-        descriptor_external_link = url_for('_get_descriptor', _external=True)
-        descriptor_internal_link = url_for('_get_descriptor', _external=False)
-        self.descriptor["baseUrl"] = descriptor_external_link.replace(
-            descriptor_internal_link, '')
-        self.descriptor["links"]["self"] = descriptor_external_link
-        return jsonify(self.descriptor)
+        return self._descriptor_response(None, '_get_descriptor', {})
+
+    def _get_profile_descriptor(self, profile):
+        """Output a named variant of the atlassian connector descriptor file"""
+        if profile not in self.profiles:
+            abort(404)
+        return self._descriptor_response(
+            profile, '_get_profile_descriptor', {'profile': profile})
+
+    def _descriptor_response(self, profile, endpoint, values):
+        descriptor_external_link = url_for(endpoint, _external=True, **values)
+        descriptor_internal_link = url_for(endpoint, _external=False, **values)
+        base_url = descriptor_external_link.replace(descriptor_internal_link, '')
+
+        # serialized once per version with a placeholder for the base url,
+        # which comes from the Host header, and compressed once per base url
+        # for the few most recently used ones
+        cached = self._descriptor_cache.get(profile)
+        if cached is None or cached[0] != self._descriptor_version:
+            parts = json.dumps(self._build_descriptor(
+                profile, _BASE_URL, _BASE_URL + descriptor_internal_link),
+                sort_keys=True).encode('utf8').split(_BASE_URL_JSON)
+            cached = (self._descriptor_version, parts,
+                      LRUCache(maxsize=_DESCRIPTOR_BASE_URLS))
+            self._descriptor_cache[profile] = cached
+
+        _, parts, by_base_url = cached
+        variants = by_base_url.get(base_url)
+        if variants is None:
+            variants = _compressed_variants(_fill_base_url(parts, base_url))
+            by_base_url.set(base_url, variants)
+        encoding = request.accept_encodings.best_match(
+            [e for e in ('br', 'gzip') if e in variants], default='identity')
+        response = (self.app or current_app).response_class(
+            variants[encoding], mimetype='application/json')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def _build_descriptor(self, profile, base_url, self_link):
+        descriptor = dict(self.descriptor)
+        descriptor["baseUrl"] = base_url
+        descriptor["links"] = dict(descriptor.get("links", {}), self=self_link)
+        if profile is None:
+            return descriptor
+
+        overrides, modules = self.profiles[profile]
+        descriptor.update(overrides)
+        if modules is not None:
+            filtered = {}
+            for location, entry in descriptor.get("modules", {}).items():
+                entry = AtlassianConnect._filter_modules(entry, modules)
+                if entry:
+                    filtered[location] = entry
+            descriptor["modules"] = filtered
+        return descriptor
+
+    @staticmethod
+    def _filter_modules(entry, modules):
+        """Keep only descriptor module entries whose key or event is listed"""
+        if isinstance(entry, list):
+            return [e for e in entry
+                    if e.get("key", e.get("event")) in modules]
+        if entry.get("key") in modules:
+            return entry
+        return None
+
+    def periodic(self, interval, name=None):
+        """
+        Periodic job decorator, run once every ``interval`` seconds for
+        every enabled tenant once :py:meth:`start_scheduler` is called
+
+        Example::
+
+            @ac.periodic(interval=60 * 60)
+            def hourly_sync(client):
+                print "Syncing %s" % client.baseUrl
+
+        Runs are spread over the interval per tenant rather than all at
+        once, see :py:class:`flask_atlassian_connect.scheduler.Scheduler`.
+
+        :param interval:
+            Seconds between runs for the same tenant
+        :type interval: float
+
+        :param name:
+            Name of the job, defaults to the function name. Each tenant's
+            slot within the interval is derived from it.
+        :type name: string
+        """
+        def _decorator(func):
+            from .scheduler import PeriodicJob
+            self.periodic_jobs.append(
+                PeriodicJob(name or func.__name__, interval, func))
+            return func
+        return _decorator
+
+    def start_scheduler(self, app=None):
+        """
+        Start running :py:meth:`periodic` jobs in the background, in every
+        process that should run them (often just one). Stopped by
+        :py:meth:`shutdown`.
+
+        :rtype: :py:class:`flask_atlassian_connect.scheduler.Scheduler`
+        """
+        from .scheduler import Scheduler
+        app = app or self.app or current_app._get_current_object()
+        if self.scheduler is None:
+            self.scheduler = Scheduler(
+                self, app,
+                workers=app.config.get('ADDON_SCHEDULER_WORKERS', 4),
+                tenant_limit=app.config.get('ADDON_SCHEDULER_TENANT_LIMIT', 1),
+                jitter=app.config.get('ADDON_SCHEDULER_JITTER', 0.1),
+                rescan=app.config.get('ADDON_SCHEDULER_RESCAN', 3600))
+            self.scheduler.start()
+        return self.scheduler
 
     def _handler_router(self, section, name):
         """
@@ -124,41 +519,153 @@ class AtlassianConnect(object):
                 'Invalid handler for %s -- %s' % (section, name))
             print((section, name, self.sections))
             abort(404)
-        ret = method()
+        if self.profiler is None:
+            return self._dispatch(section, method)
+        recording = self.profiler.begin()
+        try:
+            return self._dispatch(section, method)
+        finally:
+            context = g.get('ac_context')
+            self.profiler.end(recording, section, name,
+                              context and context.client_key)
+
+    def _dispatch(self, section, method):
+        limit = self.section_limits.get(section)
+        if limit is None:
+            return self._call_handler(method)
+        if not limit.acquire():
+            (self.app or current_app).logger.warning(
+                'Shedding %s request, section is at its concurrency limit' % section)
+            return _overloaded()
+        try:
+            return self._call_handler(method)
+        finally:
+            limit.release()
+
+    def _call_handler(self, method):
+        if self.store is None:
+            ret = method()
+        else:
+            from .store import StoreUnavailable
+            try:
+                ret = method()
+            except StoreUnavailable:
+                return '', 503, {'Retry-After': '5'}
         if ret is not None:
             return ret
         return '', 204
 
     @staticmethod
-    def _make_path(section, name):
+    def handler_path(section, name):
+        """Path a handler is served at, eg ``/atlassian_connect/webhook/jiraissue_created``"""
         return "/atlassian_connect/" + "/".join([section, name])
 
-    def _provide_client_handler(self, section, name, kwargs_updator=None):
+    def _provide_client_handler(self, section, name, kwargs_updator=None,
+                                options=None):
         def _wrapper(func):
-            @wraps(func)
-            def _handler(**kwargs):
-                client_key = self.auth.authenticate(
-                    request.method,
-                    request.url,
-                    request.headers)
-                client = self.client_class.load(client_key)
-                if not client:
-                    abort(401)
-                g.ac_client = client
-                kwargs['client'] = client
-                if kwargs_updator:
-                    kwargs.update(kwargs_updator(**kwargs))
-
-                ret = func(**kwargs)
-                if ret is not None:
-                    return ret
-                return '', 204
-            self._add_handler(section, name, _handler)
+            # partial rather than a wrapping closure, registering thousands
+            # of handlers at startup is dominated by functools.wraps otherwise
+            self._add_handler(section, name, partial(
+                self._client_handler, func, kwargs_updator, options or {}))
             return func
         return _wrapper
 
+    @staticmethod
+    def _handler_options(cache_ttl=None, cache_key=None, cache_size=1024,
+                         max_concurrency=None, process_pool=False):
+        """Per handler options shared by the module, webpanel and webhook decorators"""
+        options = {}
+        if process_pool:
+            options['process_pool'] = True
+        if max_concurrency:
+            from .limits import ConcurrencyLimit
+            options['limit'] = ConcurrencyLimit(max_concurrency)
+        if cache_ttl:
+            from .render_cache import RenderCache
+            options['render_cache'] = RenderCache(
+                cache_ttl, key=cache_key, maxsize=cache_size)
+        return options
+
+    def _client_handler(self, func, kwargs_updator, options, **kwargs):
+        limit = options.get('limit')
+        if limit is None:
+            return self._verified_handler(func, kwargs_updator, options, kwargs)
+        # checked before authenticating so shedding stays cheap
+        if not limit.acquire():
+            (self.app or current_app).logger.warning(
+                'Shedding %s request, handler is at its concurrency limit' %
+                request.path)
+            return _overloaded()
+        try:
+            return self._verified_handler(func, kwargs_updator, options, kwargs)
+        finally:
+            limit.release()
+
+    def _verified_handler(self, func, kwargs_updator, options, kwargs):
+        verified = self.auth.verify(
+            request.method,
+            request_url(),
+            request.headers)
+        # verify() raises for unknown clients, so there always is one
+        client = verified.client
+        g.ac_client = client
+        g.ac_context = TenantContext(
+            self, client, verified.client_key,
+            token=verified.token, claims=verified.claims)
+        kwargs['client'] = client
+        if kwargs_updator:
+            kwargs.update(kwargs_updator(**kwargs))
+        if options.get('process_pool'):
+            func = partial(self._run_in_process, func)
+
+        render_cache = options.get('render_cache')
+        if render_cache is not None:
+            return render_cache.respond(
+                verified.client_key, verified.claims.get('sub'), client,
+                partial(self._run_handler, func, kwargs))
+        return self._run_handler(func, kwargs)
+
+    def _run_in_process(self, func, client, **kwargs):
+        """Call func on the process pool with a snapshot of the client"""
+        from concurrent.futures.process import BrokenProcessPool
+        from .offload import call_with_client, client_snapshot
+
+        client_class, snapshot = client_snapshot(self, client)
+        pool = self.process_pool
+        try:
+            return pool.submit(
+                call_with_client, func, client_class, snapshot, kwargs).result()
+        except BrokenProcessPool:
+            # a worker died, start over with a fresh pool next time
+            with self._process_pool_lock:
+                if self._process_pool is pool:
+                    self._process_pool = None
+            pool.shutdown(wait=False)
+            raise
+
+    def _run_handler(self, func, kwargs):
+        if self.executor is not None:
+            ret = self._execute_fairly(g.ac_context.client_key, func, kwargs)
+        else:
+            ret = func(**kwargs)
+        if ret is not None:
+            return ret
+        return '', 204
+
+    def _execute_fairly(self, client_key, func, kwargs):
+        """Run func on this thread once the tenant executor admits it"""
+        from .executor import TenantQueueFull
+
+        try:
+            return self.executor.run(client_key, func, **kwargs)
+        except TenantQueueFull:
+            (self.app or current_app).logger.warning(
+                'Shedding request for %s, tenant queue is full' % client_key)
+            return _overloaded()
+
     def _add_handler(self, section, name, handler):
         self.sections.setdefault(section, {})[name] = handler
+        self.invalidate_descriptor()
 
     def lifecycle(self, name):
         """
@@ -203,54 +710,185 @@ class AtlassianConnect(object):
         section = "lifecycle"
 
         self.descriptor.setdefault('lifecycle', {})[
-            name] = AtlassianConnect._make_path(section, name)
+            name] = AtlassianConnect.handler_path(section, name)
 
         def _decorator(func):
             if name == "installed":
                 self._add_handler(section, name,
                                   self._installed_wrapper(func))
             else:
-                self._add_handler(section, name, func)
+                self._add_handler(section, name,
+                                  self._lifecycle_wrapper(name, func))
             return func
         return _decorator
 
-    def _installed_wrapper(self, func):
+    def _lifecycle_wrapper(self, name, func):
         @wraps(func)
         def inner(*args, **kwargs):
-            client = self.client_class(**request.get_json())
-            response = get(
-                client.baseUrl.rstrip('/') +
-                '/plugins/servlet/oauth/consumer-info')
-            response.raise_for_status()
+            if self.journal is not None:
+                from jwt.exceptions import InvalidTokenError
 
-            key = re.search(r"<key>(.*)</key>", response.text).groups()[0]
-            public_key = re.search(
-                r"<publicKey>(.*)</publicKey>", response.text
-            ).groups()[0]
+                # the journal changes the stored client, so only signed
+                # callbacks for the signing tenant are recorded
+                payload = request.get_json(silent=True) or {}
+                try:
+                    verified = self.auth.verify(
+                        request.method, request_url(), request.headers)
+                except InvalidTokenError:
+                    return '', 401
+                if payload.get('clientKey') != verified.client_key:
+                    return '', 401
+                self.journal.append(name, payload)
+            return func(*args, **kwargs)
+        return inner
 
-            if key != client.clientKey or public_key != client.publicKey:
-                raise Exception("Invalid Credentials")
+    def _apply_lifecycle_event(self, app, event_type, payload):
+        """Update the client store from a journaled lifecycle event"""
+        with app.app_context():
+            if event_type == 'installed':
+                # the journal only ever holds encrypted secrets
+                self._save_installed(self.client_class(**payload), encrypted=True)
+                return
+            client = self._load_client(payload.get('clientKey'))
+            if client is None:
+                return
+            enabled = event_type == 'enabled'
+            if isinstance(client, dict):
+                client['enabled'] = enabled
+            else:
+                client.enabled = enabled
+            self._save_client(client, encrypted=True)
+
+    def _save_installed(self, client, encrypted=False):
+        self._save_client(client, encrypted)
+        # the secret may have changed, drop the old signing context
+        self.token_contexts.invalidate(client.clientKey)
+
+    def shared_secret(self, client):
+        """
+        Plaintext shared secret of a client.
+
+        When ``ADDON_SECRET_KEYS`` is set, secrets are stored encrypted and
+        ``client.sharedSecret`` holds the ciphertext, so use this (or
+        :py:attr:`context`) rather than reading it directly.
+        """
+        if isinstance(client, dict):
+            client_key, secret = client.get('clientKey'), client.get('sharedSecret')
+        else:
+            client_key, secret = client.clientKey, client.sharedSecret
+        if self.secrets is None:
+            return secret
+        return self.secrets.secret_for(client_key, secret)
+
+    def _load_client(self, client_key):
+        """client_class.load, through the store guard if enabled"""
+        if self.store is None:
+            client = self.client_class.load(client_key)
+        else:
+            client = self.store.load(client_key)
+        if client is not None:
+            self.tenants.update(client)
+        return client
+
+    def _all_clients(self):
+        """client_class.all, through the store guard if enabled"""
+        if self.store is None:
+            return self.client_class.all()
+        return self.store.all()
+
+    def _save_client(self, client, encrypted=False):
+        """
+        Save through client_class, encrypting the shared secret if enabled.
+        Pass ``encrypted=True`` for clients read back from the store, whose
+        secret is ciphertext already. ``ac.tenants`` only learns about the
+        client once the save succeeded.
+        """
+        stored = client
+        if self.secrets is not None and not encrypted:
+            if isinstance(client, dict):
+                stored = dict(client, sharedSecret=self.secrets.encrypt(
+                    client.get('sharedSecret')))
+                self.secrets.invalidate(client.get('clientKey'))
+            else:
+                stored = copy.copy(client)
+                stored.sharedSecret = self.secrets.encrypt(client.sharedSecret)
+                self.secrets.invalidate(client.clientKey)
+        if self.store is None:
+            self.client_class.save(stored)
+        elif isinstance(stored, dict):
+            self.store.save(stored.get('clientKey'), stored)
+        else:
+            self.store.save(stored.clientKey, stored)
+        self.tenants.update(client)
+
+    def _delete_client(self, client_key):
+        self.tenants.remove(client_key)
+        if self.store is None:
+            self.client_class.delete(client_key)
+        else:
+            self.store.delete(client_key)
+        self.token_contexts.invalidate(client_key)
+        if self.secrets is not None:
+            self.secrets.invalidate(client_key)
 
-            stored_client = self.client_class.load(client.clientKey)
+    def _installed_wrapper(self, func):
+        @wraps(func)
+        def coalesced(*args, **kwargs):
+            from jwt.exceptions import DecodeError
+
+            payload = request.get_json()
+            stored_client = self._load_client(payload.get('clientKey'))
             if stored_client:
+                # every caller proves it may update the tenant on its own
                 token = request.headers.get('authorization', '').lstrip('JWT ')
                 if not token:
                     # Is not first install, but did not sign the request
                     # properly for an update
                     return '', 401
                 try:
-                    decode(
-                        token,
-                        stored_client.sharedSecret,
-                        options={"verify_aud": False})
+                    self.token_contexts.get(
+                        stored_client.clientKey, self.shared_secret(stored_client)
+                    ).decode(token, verify_aud=False)
                 except (ValueError, DecodeError):
                     # Invalid secret, so things did not get installed
                     return '', 401
 
-            self.client_class.save(client)
+            # Retried or double clicked installs for the same clientKey with
+            # the same payload share one consumer check, save and handler
+            # call, however each of them was signed
+            key = (payload.get('clientKey'),
+                   hashlib.sha256(request.get_data()).hexdigest())
+            return _own_response(self._installs.do(
+                key, inner, payload, *args, **kwargs))
+
+        def inner(payload, *args, **kwargs):
+            from requests import get
+
+            client = self.client_class(**payload)
+            response = get(
+                client.baseUrl.rstrip('/') +
+                '/plugins/servlet/oauth/consumer-info')
+            response.raise_for_status()
+
+            key = _CONSUMER_KEY_RE.search(response.text).groups()[0]
+            public_key = _CONSUMER_PUBLIC_KEY_RE.search(
+                response.text).groups()[0]
+
+            if key != client.clientKey or public_key != client.publicKey:
+                raise Exception("Invalid Credentials")
+
+            if self.journal is not None:
+                # applied to the client store in the background
+                if self.secrets is not None:
+                    # keep the plaintext secret out of the journal too
+                    payload = dict(payload, sharedSecret=self.secrets.encrypt(
+                        payload.get('sharedSecret')))
+                self.journal.append('installed', payload)
+            else:
+                self._save_installed(client)
             kwargs['client'] = client
             return func(*args, **kwargs)
-        return inner
+        return coalesced
 
     def webhook(self, event, exclude_body=False, **kwargs):
         """
@@ -284,33 +922,59 @@ class AtlassianConnect(object):
             If not specified no properties will be returned.
         :type event: array
 
+        :param max_concurrency:
+            How many requests for this webhook may run at once, further ones
+            get a 503 with ``Retry-After`` straight away. Also accepted by
+            :py:meth:`module` and :py:meth:`webpanel`, see
+            ``ADDON_SECTION_CONCURRENCY`` for limits per section.
+        :type max_concurrency: int
+
+        :param process_pool:
+            Run the handler in a worker process (see :py:attr:`process_pool`)
+            so CPU heavy work does not hold the GIL of the web process. The
+            handler gets a copy of the client and the parsed event, there is
+            no request, ``g`` or app context. The handler has to be a module
+            level function and its arguments and return value picklable.
+        :type process_pool: bool
+
         .. _filtering: https://developer.atlassian.com/static/connect/docs/beta/modules/common/webhook.html#Filtering
         .. _external webhooks: https://developer.atlassian.com/jiradev/jira-apis/webhooks
         """
         section = 'webhook'
+        options = AtlassianConnect._handler_options(
+            **AtlassianConnect._pop_options(kwargs, 'webhook'))
+        name, webhook = AtlassianConnect._webhook_descriptor(
+            event, exclude_body, **kwargs)
 
+        self.descriptor.setdefault('modules', {}).setdefault(
+            'webhooks', []).append(webhook)
+
+        return self._provide_client_handler(
+            section, name, kwargs_updator=AtlassianConnect._webhook_kwargs,
+            options=options)
+
+    @staticmethod
+    def _webhook_kwargs(**kwargs):
+        del kwargs
+        content = request.get_json(silent=False)
+        return {"event": content}
+
+    @staticmethod
+    def _webhook_descriptor(event, exclude_body=False, **kwargs):
+        """Returns (handler name, descriptor entry) for a webhook"""
+        name = event.replace(":", "")
         webhook = {
             "event": event,
-            "url": AtlassianConnect._make_path(section, event.replace(":", "")),
+            "url": AtlassianConnect.handler_path('webhook', name),
             "excludeBody": exclude_body
         }
         if kwargs.get('filter'):
-            webhook["filter"] = kwargs.pop('filter')
+            webhook["filter"] = kwargs['filter']
         if kwargs.get('propertyKeys'):
-            webhook["propertyKeys"] = kwargs.pop('propertyKeys')
+            webhook["propertyKeys"] = kwargs['propertyKeys']
+        return name, webhook
 
-        self.descriptor.setdefault('modules', {}).setdefault(
-            'webhooks', []).append(webhook)
-
-        def _wrapper(**kwargs):
-            del kwargs
-            content = request.get_json(silent=False)
-            return {"event": content}
-
-        return self._provide_client_handler(
-            section, event.replace(":", ""), kwargs_updator=_wrapper)
-
-    def module(self, key, name=None, location=None):
+    def module(self, key, name=None, location=None, **kwargs):
         """
         Module decorator. See `external modules`_ documentation
 
@@ -342,20 +1006,48 @@ class AtlassianConnect(object):
             A human readable name.
         :type event: string
 
+        :param cache_ttl:
+            Cache successful renders for this many seconds, per tenant.
+            Repeat requests skip the handler and browsers get ETags/304s.
+            See :py:class:`flask_atlassian_connect.render_cache.RenderCache`
+        :type cache_ttl: float
+
+        :param cache_key:
+            callable(client, args) giving the cache key for a request, or
+            None to skip the cache. Defaults to all the request arguments.
+
+        :param cache_size:
+            How many renders to keep for this module
+        :type cache_size: int
+
+        :param max_concurrency:
+            How many requests for this module may run at once, see
+            :py:meth:`webhook`
+        :type max_concurrency: int
+
         .. _external modules: https://developer.atlassian.com/static/connect/docs/beta/modules/common/web-section.html
         """
-        name = name or key
-        location = location or key
         section = 'module'
+        location, module = AtlassianConnect._module_descriptor(
+            key, name, location)
 
-        self.descriptor.setdefault('modules', {})[location] = {
-            "url": AtlassianConnect._make_path(section, key),
-            "name": {"value": name},
-            "key": key
+        self.descriptor.setdefault('modules', {})[location] = module
 
-        }
+        options = AtlassianConnect._pop_options(kwargs, section)
+        return self._provide_client_handler(
+            section, key,
+            options=AtlassianConnect._handler_options(**dict(kwargs, **options)))
 
-        return self._provide_client_handler(section, key)
+    @staticmethod
+    def _module_descriptor(key, name=None, location=None):
+        """Returns (location, descriptor entry) for a module"""
+        if not _MODULE_KEY_RE.match(key):
+            raise Exception("Module(%s) must match ^[a-zA-Z0-9-]+$" % key)
+        return location or key, {
+            "url": AtlassianConnect.handler_path('module', key),
+            "name": {"value": name or key},
+            "key": key
+        }
 
     def webpanel(self, key, name=None, location=None, **kwargs):
         """
@@ -395,32 +1087,123 @@ class AtlassianConnect(object):
             A human readable name.
         :type event: string
 
+        :param cache_ttl:
+            Cache successful renders for this many seconds, per tenant, see
+            :py:meth:`module`. By default the cache key is the request
+            arguments, ie the issueKey.
+        :type cache_ttl: float
+
         Anything else from the `external webpanel`_ docs should also work
 
         .. _external webpanel: https://developer.atlassian.com/static/connect/docs/beta/modules/common/web-panel.html
         """
-        name = name or key
-        location = location or key
         section = 'webpanel'
+        options = AtlassianConnect._handler_options(
+            **AtlassianConnect._pop_options(kwargs, section))
+        webpanel_capability = AtlassianConnect._webpanel_descriptor(
+            key, name, location, **kwargs)
 
-        if not re.search(r"^[a-zA-Z0-9-]+$", key):
+        self.descriptor.setdefault(
+            'modules', {}
+        ).setdefault(
+            'webPanels', []
+        ).append(webpanel_capability)
+        return self._provide_client_handler(section, key, options=options)
+
+    @staticmethod
+    def _pop_options(kwargs, section=None):
+        """Take the handler options (see _handler_options) out of kwargs"""
+        options = {}
+        for option in _HANDLER_OPTIONS:
+            if option in kwargs:
+                options[option] = kwargs.pop(option)
+        if section == 'webhook' and options.get('cache_ttl'):
+            # the cache key is built from the query string, never the body
+            raise ValueError("cache_ttl is not supported for webhooks")
+        if section in ('module', 'webpanel') and options.get('process_pool'):
+            # rendered pages need the request and templates of this process
+            raise ValueError("process_pool is only supported for webhooks")
+        return options
+
+    @staticmethod
+    def _webpanel_descriptor(key, name=None, location=None, **kwargs):
+        """Returns the descriptor entry for a webpanel"""
+        if not _MODULE_KEY_RE.match(key):
             raise Exception("Webpanel(%s) must match ^[a-zA-Z0-9-]+$" % key)
 
         webpanel_capability = {
             "key": key,
-            "name": {"value": name},
-            "url": AtlassianConnect._make_path(section, key) + '?issueKey={issue.key}',
-            "location": location
+            "name": {"value": name or key},
+            "url": AtlassianConnect.handler_path('webpanel', key) + '?issueKey={issue.key}',
+            "location": location or key
         }
         if kwargs.get('conditions'):
-            webpanel_capability['conditions'] = kwargs.pop('conditions')
+            webpanel_capability['conditions'] = kwargs['conditions']
+        return webpanel_capability
 
-        self.descriptor.setdefault(
-            'modules', {}
-        ).setdefault(
-            'webPanels', []
-        ).append(webpanel_capability)
-        return self._provide_client_handler(section, key)
+    def register_modules(self, modules):
+        """
+        Register many webhooks, modules and webpanels at once.
+
+        Does the same thing as calling the individual decorators, but the
+        descriptor is only touched once, which adds up when thousands of
+        modules are generated at startup.
+
+        Example::
+
+            ac.register_modules([
+                {"type": "webhook", "event": "jira:issue_created",
+                 "handler": issue_created},
+                {"type": "module", "key": "configurePage",
+                 "name": "Configure", "handler": configure_page},
+                {"type": "webpanel", "key": "userPanel",
+                 "location": "atl.jira.view.issue.right.context",
+                 "handler": user_panel},
+            ])
+
+        :param modules:
+            Each entry has a ``type`` (webhook, module or webpanel), the
+            ``handler`` function and the same arguments as the matching
+            decorator.
+        :type modules: list of dict
+        """
+        webhooks = []
+        webpanels = []
+        locations = {}
+        handlers = []
+        for entry in modules:
+            entry = dict(entry)
+            kind = entry.pop('type')
+            handler = entry.pop('handler')
+            options = AtlassianConnect._pop_options(entry, kind)
+            if kind == 'webhook':
+                name, webhook = AtlassianConnect._webhook_descriptor(**entry)
+                webhooks.append(webhook)
+                handlers.append((kind, name, handler,
+                                 AtlassianConnect._webhook_kwargs, options))
+            elif kind == 'module':
+                location, module = AtlassianConnect._module_descriptor(**entry)
+                locations[location] = module
+                handlers.append((kind, entry['key'], handler, None, options))
+            elif kind == 'webpanel':
+                webpanels.append(AtlassianConnect._webpanel_descriptor(**entry))
+                handlers.append((kind, entry['key'], handler, None, options))
+            else:
+                raise ValueError("Unknown module type %s" % kind)
+
+        descriptor_modules = self.descriptor.setdefault('modules', {})
+        if webhooks:
+            descriptor_modules.setdefault('webhooks', []).extend(webhooks)
+        if webpanels:
+            descriptor_modules.setdefault('webPanels', []).extend(webpanels)
+        descriptor_modules.update(locations)
+
+        # straight into the routing table, dropping the serialized descriptor once
+        for section, name, handler, kwargs_updator, options in handlers:
+            self.sections.setdefault(section, {})[name] = partial(
+                self._client_handler, handler, kwargs_updator,
+                AtlassianConnect._handler_options(**options) if options else {})
+        self.invalidate_descriptor()
 
     def tasks(self):
         """Function that turns a collection of tasks
@@ -458,14 +1241,14 @@ class AtlassianConnect(object):
             from json import loads
             with (self.app or current_app).app_context():
                 client = loads(data)
-                self.client_class.save(client)
+                self._save_client(client)
                 print("Added")
 
         @task()
         def uninstall(ctx, clientKey):
             """Remove a given client from the database"""
             with (self.app or current_app).app_context():
-                self.client_class.delete(clientKey)
+                self._delete_client(clientKey)
                 print("Deleted")
 
         ns = Collection('clients')
@@ -0,0 +1,65 @@
+"""Small in-memory caches shared by the rest of the package"""
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+_MISSING = object()
+
+
+class LRUCache(object):
+    """
+    Thread safe, size bounded, least-recently-used mapping
+
+    :param maxsize:
+        Entries kept before the least recently used one is evicted
+    :type maxsize: int
+
+    :param ttl:
+        Optional number of seconds an entry stays valid
+    :type ttl: float
+    """
+    def __init__(self, maxsize=1024, ttl=None, timer=monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._timer = timer
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Returns the cached value for key, marking it recently used"""
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            expires, value = entry
+            if expires is not None and expires <= self._timer():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=_MISSING):
+        """Caches value for key, ttl defaults to the cache wide ttl"""
+        ttl = self.ttl if ttl is _MISSING else ttl
+        expires = None if ttl is None else self._timer() + ttl
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Removes key, returning its value if it was cached"""
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,77 @@
+"""
+Canonical request and query string hash (qsh) computation.
+
+Verification of incoming requests and signing of outgoing urls both go
+through here so they can never disagree about what a request looks like.
+Results are memoized on the current request and in a bounded LRU, since
+iframe urls (the same panel for the same issue) repeat a lot.
+"""
+from hashlib import sha256
+
+from flask import g, has_request_context, request
+
+from .cache import LRUCache
+
+_hashes = LRUCache(maxsize=4096)
+
+
+def canonical_request(http_method, url):
+    """
+    Atlassian canonical request, eg ``GET&/path&a=1&b=2``
+
+    :param url:
+        Url relative to the addon's base url, the ``jwt`` parameter is
+        ignored if present
+    """
+    return _canonical(http_method, url)[0]
+
+
+def query_string_hash(http_method, url):
+    """qsh claim value for the request"""
+    return _canonical(http_method, url)[1]
+
+
+def _without_jwt(url):
+    """
+    The url without its ``jwt`` parameter, which is unique per token and
+    ignored by the canonical request anyway
+    """
+    path, sep, query = url.partition('?')
+    if not sep or 'jwt' not in query:
+        return url
+    params = [p for p in query.split('&') if p.partition('=')[0] != 'jwt']
+    if params:
+        return path + '?' + '&'.join(params)
+    return path
+
+
+def _canonical(http_method, url):
+    key = (http_method.upper(), _without_jwt(url))
+    if has_request_context():
+        memo = g.setdefault('_ac_canonical', {})
+        result = memo.get(key)
+        if result is None:
+            result = memo[key] = _lookup(key)
+        return result
+    return _lookup(key)
+
+
+def _lookup(key):
+    result = _hashes.get(key)
+    if result is None:
+        from atlassian_jwt.url_utils import canonicalize_request
+        canonical = canonicalize_request(*key)
+        result = (canonical, sha256(canonical.encode('utf8')).hexdigest())
+        _hashes.set(key, result)
+    return result
+
+
+def request_url():
+    """
+    Current request's url relative to the addon base url, which is what
+    Atlassian signs and what we sign for links back to ourselves
+    """
+    query_string = request.query_string.decode('utf8', errors='replace')
+    if query_string:
+        return request.path + '?' + query_string
+    return request.path
@@ -0,0 +1,88 @@
+"""Request scoped information about the tenant being served"""
+from flask import request
+
+from .canonical import canonical_request, query_string_hash, request_url
+
+_UNSET = object()
+
+
+class TenantContext(object):
+    """
+    Built once per authenticated request and available as ``g.ac_context``
+    (or ``ac_context`` in templates). Derived values are only computed when
+    first asked for.
+
+    :ivar client: the tenant's client object
+    :ivar client_key: the tenant's clientKey
+    :ivar token: the JWT the request was authenticated with
+    """
+    __slots__ = ('addon', 'client', 'client_key', 'token', '_claims', '_url',
+                 '_base_url', '_token_context')
+
+    def __init__(self, addon, client, client_key, token=None, claims=None):
+        self.addon = addon
+        self.client = client
+        self.client_key = client_key
+        self.token = token
+        self._claims = claims
+        self._url = None
+        self._base_url = _UNSET
+        self._token_context = None
+
+    @property
+    def claims(self):
+        """Claims of the (already verified) request JWT"""
+        if self._claims is None:
+            if self.token is None:
+                return {}
+            from .tokens import unverified_claims
+            self._claims = unverified_claims(self.token)
+        return self._claims
+
+    @property
+    def account_id(self):
+        """Atlassian account id of the user making the request, if any"""
+        return self.claims.get('sub')
+
+    @property
+    def product_context(self):
+        """Product context (issue, project, etc) from the request JWT"""
+        return self.claims.get('context') or {}
+
+    @property
+    def url(self):
+        """Request url relative to the addon base url"""
+        if self._url is None:
+            self._url = request_url()
+        return self._url
+
+    @property
+    def canonical_request(self):
+        return canonical_request(request.method, self.url)
+
+    @property
+    def qsh(self):
+        return query_string_hash(request.method, self.url)
+
+    @property
+    def base_url(self):
+        """The product's base url, without a trailing slash"""
+        if self._base_url is _UNSET:
+            if isinstance(self.client, dict):
+                base_url = self.client.get('baseUrl')
+            else:
+                base_url = getattr(self.client, 'baseUrl', None)
+            self._base_url = (base_url or '').rstrip('/')
+        return self._base_url
+
+    def product_url(self, path):
+        """Absolute url for a path on the tenant's product"""
+        return self.base_url + '/' + path.lstrip('/')
+
+    @property
+    def token_context(self):
+        """:py:class:`TokenContext` to sign and verify tokens as this tenant"""
+        if self._token_context is None:
+            self._token_context = self.addon.token_contexts.get(
+                self.client_key, self.addon.shared_secret(self.client))
+        return self._token_context
@@ -0,0 +1,80 @@
+"""
+Envelope encryption of client shared secrets.
+
+Requires the ``cryptography`` package.
+"""
+from cryptography.fernet import Fernet, MultiFernet
+
+from .cache import LRUCache
+
+PREFIX = 'enc1:'
+
+
+def generate_key():
+    """New master key, suitable for ``ADDON_SECRET_KEYS``"""
+    return Fernet.generate_key().decode('ascii')
+
+
+class SecretBox(object):
+    """
+    Encrypts shared secrets before they reach the client store.
+
+    Every secret gets its own data key, which is stored next to it wrapped
+    by the master key (``enc1:<wrapped data key>:<encrypted secret>``).
+    Decrypted secrets are kept in a bounded in-memory cache keyed by
+    clientKey, so the authentication hot path only pays for decryption
+    when a tenant is first seen or its secret changes.
+
+    :param master_keys:
+        Fernet keys. The first one encrypts, all of them decrypt, so new
+        keys can be rotated in at the front.
+    :type master_keys: list
+
+    :param cache_size:
+        How many decrypted secrets to keep in memory
+    :type cache_size: int
+    """
+    def __init__(self, master_keys, cache_size=10000):
+        if isinstance(master_keys, (str, bytes)):
+            master_keys = [master_keys]
+        self._master = MultiFernet([Fernet(key) for key in master_keys])
+        self._plaintexts = LRUCache(cache_size)
+
+    @staticmethod
+    def is_encrypted(value):
+        return isinstance(value, str) and value.startswith(PREFIX)
+
+    def encrypt(self, secret):
+        """
+        Encrypt a plaintext secret. Always encrypts, even a secret that
+        looks like ciphertext already, so a tenant cannot pick a secret
+        that ends up stored as chosen ciphertext.
+        """
+        if secret is None:
+            return secret
+        data_key = Fernet.generate_key()
+        return PREFIX + ':'.join([
+            self._master.encrypt(data_key).decode('ascii'),
+            Fernet(data_key).encrypt(secret.encode('utf8')).decode('ascii'),
+        ])
+
+    def decrypt(self, value):
+        """Decrypt a value from :py:meth:`encrypt`, plaintext is passed through"""
+        if not SecretBox.is_encrypted(value):
+            return value
+        wrapped, ciphertext = value[len(PREFIX):].split(':', 1)
+        data_key = self._master.decrypt(wrapped.encode('ascii'))
+        return Fernet(data_key).decrypt(ciphertext.encode('ascii')).decode('utf8')
+
+    def secret_for(self, client_key, value):
+        """Decrypted secret for the tenant, from cache when unchanged"""
+        cached = self._plaintexts.get(client_key)
+        if cached is not None and cached[0] == value:
+            return cached[1]
+        secret = self.decrypt(value)
+        self._plaintexts.set(client_key, (value, secret))
+        return secret
+
+    def invalidate(self, client_key):
+        """Forget the tenant's decrypted secret"""
+        self._plaintexts.pop(client_key)
@@ -0,0 +1,116 @@
+"""Per tenant fair admission of handler execution"""
+import threading
+from collections import deque
+
+
+class TenantQueueFull(Exception):
+    """Raised when a tenant already has as much work waiting as allowed"""
+
+
+class _Ticket(object):
+    __slots__ = ('granted',)
+
+    def __init__(self):
+        self.granted = threading.Event()
+
+
+class TenantExecutor(object):
+    """
+    Lets a bounded number of handler calls run at once, taking turns
+    between tenants for the free slots.
+
+    Callers run their work on their own thread once they have a slot, so
+    no extra threads are involved. Callers waiting for a slot are queued
+    per clientKey and tenants are served round-robin, so one tenant
+    flooding the addon only ever competes for its own turn instead of
+    starving everyone queued behind it. A tenant with a weight of ``n`` gets
+    up to ``n`` slots per turn.
+
+    Every waiting request holds a server thread, so the slots only help if
+    the server has more threads (or greenlets) than ``workers``.
+
+    :param workers:
+        Number of calls that may run at the same time
+    :type workers: int
+
+    :param queue_limit:
+        How many calls one tenant may have waiting before new work for that
+        tenant is shed with :py:class:`TenantQueueFull`
+    :type queue_limit: int
+
+    :param weights:
+        Optional clientKey to weight mapping, defaults to 1 for everyone
+    :type weights: dict
+    """
+    def __init__(self, workers=4, queue_limit=100, weights=None):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.weights = weights or {}
+        self._lock = threading.Lock()
+        self._free = workers
+        self._queues = {}
+        self._ready = deque()
+        self._served = {}
+        self._shutdown = False
+
+    def pending(self, client_key):
+        """Number of calls waiting for the given tenant"""
+        with self._lock:
+            return len(self._queues.get(client_key, ()))
+
+    def run(self, client_key, func, *args, **kwargs):
+        """
+        Wait for a slot, then call func(*args, **kwargs) on this thread
+
+        :raises TenantQueueFull: if the tenant is at its queue limit
+        """
+        self._acquire(client_key)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._release()
+
+    def shutdown(self):
+        """Refuse new work, calls already admitted or waiting still run"""
+        with self._lock:
+            self._shutdown = True
+
+    def _acquire(self, client_key):
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError('TenantExecutor has been shut down')
+            if self._free > 0 and not self._ready:
+                self._free -= 1
+                return
+            queue = self._queues.get(client_key)
+            if queue is None:
+                queue = self._queues[client_key] = deque()
+                self._ready.append(client_key)
+            elif len(queue) >= self.queue_limit:
+                raise TenantQueueFull(client_key)
+            ticket = _Ticket()
+            queue.append(ticket)
+        ticket.granted.wait()
+
+    def _release(self):
+        with self._lock:
+            if self._ready:
+                # hand the slot straight to the next caller in fair order
+                self._next_ticket().granted.set()
+            else:
+                self._free += 1
+
+    def _next_ticket(self):
+        """Pop the next waiting caller in fair order, must hold the lock"""
+        client_key = self._ready[0]
+        queue = self._queues[client_key]
+        ticket = queue.popleft()
+        served = self._served.pop(client_key, 0) + 1
+        if not queue:
+            del self._queues[client_key]
+            self._ready.popleft()
+        elif served >= max(1, int(self.weights.get(client_key, 1))):
+            self._ready.rotate(-1)
+        else:
+            self._served[client_key] = served
+        return ticket
@@ -0,0 +1,165 @@
+"""In-memory secondary indexes over known tenants"""
+import sys
+import threading
+from urllib.parse import urlsplit
+
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_url(url):
+    """
+    ``scheme://host[:port][/path]`` with the scheme and host lower cased,
+    default ports and trailing slashes dropped, and no query or fragment
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port != _DEFAULT_PORTS.get(scheme):
+        host = '%s:%d' % (host, parts.port)
+    return '%s://%s%s' % (scheme, host, parts.path.rstrip('/'))
+
+
+def _fields(client):
+    if isinstance(client, dict):
+        return (client.get('clientKey'), client.get('baseUrl'),
+                client.get('productType'), client.get('enabled') is not False)
+    return (client.clientKey, getattr(client, 'baseUrl', None),
+            getattr(client, 'productType', None),
+            getattr(client, 'enabled', None) is not False)
+
+
+class TenantIndex(object):
+    """
+    Finds tenants by ``baseUrl``, ``productType`` and enabled state
+    without going through ``client_class.all()``.
+
+    :py:class:`AtlassianConnect` keeps ``ac.tenants`` up to date with
+    every client it loads, saves or deletes; call :py:meth:`rebuild` with
+    ``client_class.all()`` at startup to know about every tenant straight
+    away. Only clientKeys, baseUrls and interned productTypes are kept,
+    never the clients themselves.
+
+    Example::
+
+        client_key = ac.tenants.lookup(
+            'https://example.atlassian.net/wiki/spaces/DOC/overview')
+        jira_keys = ac.tenants.client_keys(product_type='jira', enabled=True)
+    """
+    __slots__ = ('_entries', '_by_url', '_by_product', '_disabled', '_lock')
+
+    def __init__(self):
+        self._entries = {}
+        self._by_url = {}
+        self._by_product = {}
+        self._disabled = set()
+        self._lock = threading.Lock()
+
+    def update(self, client):
+        """Index a client, or refresh its entry"""
+        client_key, base_url, product_type, enabled = _fields(client)
+        if client_key is None:
+            return
+        entry = self._entries.get(client_key)
+        if entry is not None and entry[1:] == (base_url, product_type, enabled):
+            return
+        with self._lock:
+            self._remove(client_key)
+            client_key = sys.intern(client_key)
+            url_key = normalize_url(base_url) if base_url else None
+            if url_key == base_url:
+                # share the client's string rather than keep a second copy
+                url_key = base_url
+            if product_type is not None:
+                product_type = sys.intern(product_type)
+                self._by_product.setdefault(product_type, set()).add(client_key)
+            if url_key is not None:
+                self._by_url[url_key] = client_key
+            if not enabled:
+                self._disabled.add(client_key)
+            self._entries[client_key] = (url_key, base_url, product_type, enabled)
+
+    def remove(self, client_key):
+        with self._lock:
+            self._remove(client_key)
+
+    def _remove(self, client_key):
+        entry = self._entries.pop(client_key, None)
+        if entry is None:
+            return
+        url_key, _, product_type, _ = entry
+        if url_key is not None and self._by_url.get(url_key) == client_key:
+            del self._by_url[url_key]
+        if product_type is not None:
+            keys = self._by_product[product_type]
+            keys.discard(client_key)
+            if not keys:
+                del self._by_product[product_type]
+        self._disabled.discard(client_key)
+
+    def rebuild(self, clients):
+        """
+        Replace the index with the given clients (a list or a dict of them).
+        The new index is built on the side and swapped in, so lookups never
+        see it half built.
+        """
+        if isinstance(clients, dict):
+            clients = clients.values()
+        fresh = TenantIndex()
+        for client in clients:
+            fresh.update(client)
+        with self._lock:
+            self._entries = fresh._entries
+            self._by_url = fresh._by_url
+            self._by_product = fresh._by_product
+            self._disabled = fresh._disabled
+
+    def by_base_url(self, base_url):
+        """clientKey of the tenant with exactly this baseUrl, or None"""
+        return self._by_url.get(normalize_url(base_url))
+
+    def lookup(self, url):
+        """
+        clientKey of the tenant any product url belongs to, or None.
+
+        The longest matching baseUrl wins, so a Confluence tenant at
+        ``https://example.atlassian.net/wiki`` is found rather than Jira at
+        the same host. Costs one dict lookup per path segment.
+        """
+        url = normalize_url(url)
+        by_url = self._by_url
+        while True:
+            client_key = by_url.get(url)
+            if client_key is not None:
+                return client_key
+            head, sep, _ = url.rpartition('/')
+            if not sep or head.endswith('/'):
+                return None
+            url = head
+
+    def client_keys(self, product_type=None, enabled=None):
+        """
+        clientKeys, optionally only of one productType and/or enabled state
+
+        :rtype: set
+        """
+        if product_type is None:
+            keys = set(self._entries)
+        else:
+            keys = set(self._by_product.get(product_type, ()))
+        if enabled is True:
+            keys -= self._disabled
+        elif enabled is False:
+            keys &= self._disabled
+        return keys
+
+    def is_enabled(self, client_key):
+        """False for disabled or uninstalled tenants, None for unknown ones"""
+        if client_key not in self._entries:
+            return None
+        return client_key not in self._disabled
+
+    def __contains__(self, client_key):
+        return client_key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,316 @@
+"""Append-only journal of lifecycle events"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+from time import monotonic, time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS lifecycle_journal (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created REAL NOT NULL,
+    event_type TEXT NOT NULL,
+    client_key TEXT,
+    payload TEXT NOT NULL,
+    applied INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+)
+"""
+
+
+class _Append(object):
+    __slots__ = ('event_type', 'payload', 'done', 'id', 'error')
+
+    def __init__(self, event_type, payload):
+        self.event_type = event_type
+        self.payload = payload
+        self.done = threading.Event()
+        self.id = None
+        self.error = None
+
+
+class LifecycleJournal(object):
+    """
+    Durable, append-only log of lifecycle events in a SQLite write-ahead log.
+
+    :py:meth:`append` returns once the event is on disk. Appends that arrive
+    while a commit is in flight are written together in the next
+    transaction (group commit), so a burst of installs costs a handful of
+    fsyncs rather than one each. A background thread then hands every
+    committed event, in order, to ``apply``. An event that fails to apply is
+    retried with exponential backoff, holding back the ones after it, and
+    only given up on (recorded with its error) after ``max_attempts``.
+    Events that were not applied before a restart are applied when the
+    journal is used again, and the table doubles as an audit trail of every
+    lifecycle callback.
+
+    The background threads are started by the first call that needs them,
+    and again in a forked child, so the journal can be created before a
+    pre-forking server starts its workers. When several processes share the
+    file, only the one holding a lock on ``<path>.apply-lock`` applies
+    events, taking over every ``poll_interval`` seconds if that process
+    goes away, so events are applied once and in order.
+
+    :param path:
+        SQLite database file
+    :type path: string
+
+    :param apply:
+        callable(event_type, payload) that updates the client store, or None
+        to only record events
+
+    :param max_attempts:
+        Times an event is tried before it is given up on
+    :type max_attempts: int
+
+    :param retry_delay:
+        Seconds before the first retry, doubled for every further one
+    :type retry_delay: float
+
+    :param poll_interval:
+        Seconds between looks for events appended by other processes
+    :type poll_interval: float
+    """
+    def __init__(self, path, apply=None, max_batch=500, max_attempts=5,
+                 retry_delay=0.1, poll_interval=1.0):
+        self.path = path
+        self.apply = apply
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.commits = 0
+        self._cond = threading.Condition()
+        self._pending = []
+        self._closed = False
+        self._pid = None
+        self._threads = []
+
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(_SCHEMA)
+        conn.commit()
+        conn.close()
+
+    def _start(self):
+        """Start the background threads in this process, if not running yet"""
+        if self._pid == os.getpid():
+            return
+        with self._cond:
+            pid = os.getpid()
+            if self._pid == pid:
+                return
+            if self._pid is not None:
+                # forked: the parent's threads and waiters did not come along
+                self._cond = threading.Condition()
+                self._pending = []
+            self._pid = pid
+            self._threads = [threading.Thread(
+                target=self._write, name='ac-journal-writer')]
+            if self.apply is not None:
+                self._threads.append(threading.Thread(
+                    target=self._apply, name='ac-journal-apply'))
+            for thread in self._threads:
+                thread.daemon = True
+                thread.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA synchronous=FULL")
+        return conn
+
+    def append(self, event_type, payload):
+        """
+        Durably record a lifecycle event
+
+        :returns: journal id of the event
+        :rtype: int
+        """
+        entry = _Append(event_type, payload)
+        self._start()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('LifecycleJournal is closed')
+            self._pending.append(entry)
+            self._cond.notify_all()
+        entry.done.wait()
+        if entry.error is not None:
+            raise entry.error
+        return entry.id
+
+    def entries(self, since=0):
+        """
+        Recorded events after the given journal id, oldest first
+
+        :rtype: list of dict
+        """
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT id, created, event_type, client_key, payload, applied, error"
+                " FROM lifecycle_journal WHERE id > ? ORDER BY id", (since,))
+            return [{
+                "id": row[0], "created": row[1], "eventType": row[2],
+                "clientKey": row[3], "payload": json.loads(row[4]),
+                "applied": bool(row[5]), "error": row[6],
+            } for row in rows]
+        finally:
+            conn.close()
+
+    def flush(self, timeout=None):
+        """
+        Wait until everything recorded so far has been applied or given up
+        on, by whichever process applies events
+
+        :returns: False if the timeout expired first
+        """
+        if self.apply is None:
+            return True
+        self._start()
+        deadline = None if timeout is None else monotonic() + timeout
+        conn = self._connect()
+        try:
+            target = conn.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM lifecycle_journal").fetchone()[0]
+            while conn.execute(
+                    "SELECT 1 FROM lifecycle_journal WHERE id <= ? AND applied = 0"
+                    " LIMIT 1", (target,)).fetchone():
+                wait = self.poll_interval
+                if deadline is not None:
+                    wait = min(wait, deadline - monotonic())
+                    if wait <= 0:
+                        return False
+                with self._cond:
+                    self._cond.wait(wait)
+            return True
+        finally:
+            conn.close()
+
+    def close(self):
+        """Finish outstanding writes and stop the background threads"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def _write(self):
+        conn = self._connect()
+        try:
+            while True:
+                with self._cond:
+                    self._cond.wait_for(lambda: self._pending or self._closed)
+                    if not self._pending:
+                        return
+                    batch = self._pending[:self.max_batch]
+                    del self._pending[:self.max_batch]
+                try:
+                    with conn:
+                        for entry in batch:
+                            entry.id = conn.execute(
+                                "INSERT INTO lifecycle_journal"
+                                " (created, event_type, client_key, payload)"
+                                " VALUES (?, ?, ?, ?)",
+                                (time(), entry.event_type,
+                                 entry.payload.get('clientKey'),
+                                 json.dumps(entry.payload))).lastrowid
+                except Exception as ex:  # pylint: disable=broad-except
+                    for entry in batch:
+                        entry.error = ex
+                else:
+                    with self._cond:
+                        self.commits += 1
+                        self._cond.notify_all()
+                for entry in batch:
+                    entry.done.set()
+        finally:
+            conn.close()
+
+    def _wait(self, predicate, timeout):
+        """Wait for predicate or close(), returns True once closed"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._closed or predicate(), timeout)
+            return self._closed
+
+    def _lock_applier(self):
+        """
+        Open file holding the apply lock once this process has it, or None
+        if the journal was closed first
+        """
+        if fcntl is None:
+            return open(os.devnull)
+        lock = open(self.path + '.apply-lock', 'a')
+        while True:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return lock
+            except OSError:
+                if self._wait(lambda: False, self.poll_interval):
+                    lock.close()
+                    return None
+
+    def _apply(self):
+        lock = self._lock_applier()
+        if lock is None:
+            return
+        conn = self._connect()
+        writer = self._threads[0]
+        try:
+            while True:
+                seen = self.commits
+                drained = self._closed and not writer.is_alive()
+                rows = conn.execute(
+                    "SELECT id, event_type, payload FROM lifecycle_journal"
+                    " WHERE applied = 0 ORDER BY id LIMIT ?",
+                    (self.max_batch,)).fetchall()
+                for row_id, event_type, payload in rows:
+                    error = self._apply_with_retries(row_id, event_type, payload)
+                    if error is False:
+                        # closed while retrying, applied again on next start
+                        return
+                    with conn:
+                        conn.execute(
+                            "UPDATE lifecycle_journal SET applied = 1, error = ?"
+                            " WHERE id = ?", (error, row_id))
+                    with self._cond:
+                        self._cond.notify_all()
+                if rows:
+                    continue
+                if drained:
+                    return
+                if self._closed:
+                    # the last writes are still going in
+                    writer.join()
+                    continue
+                # woken by local commits, events from other processes are
+                # picked up on the next poll
+                self._wait(lambda: self.commits != seen, self.poll_interval)
+        finally:
+            conn.close()
+            lock.close()
+
+    def _apply_with_retries(self, row_id, event_type, payload):
+        """
+        :returns: None once applied, the last error once given up on, or
+            False if the journal was closed before either
+        """
+        error = None
+        for attempt in range(max(1, self.max_attempts)):
+            if attempt and self._wait(
+                    lambda: False, self.retry_delay * 2 ** (attempt - 1)):
+                return False
+            try:
+                self.apply(event_type, json.loads(payload))
+                return None
+            except Exception as ex:  # pylint: disable=broad-except
+                logger.exception('Could not apply lifecycle event %s', row_id)
+                error = repr(ex)
+        return error
@@ -0,0 +1,38 @@
+"""Concurrency caps used to shed load per section and per handler"""
+import threading
+
+
+class ConcurrencyLimit(object):
+    """
+    Non-blocking counting semaphore.
+
+    :py:meth:`acquire` never waits, a request over the limit is meant to be
+    turned away straight away rather than queue up behind slow ones.
+
+    :param limit:
+        Requests allowed to run at the same time
+    :type limit: int
+
+    :ivar active: requests currently holding a slot
+    :ivar shed: requests turned away so far
+    """
+    def __init__(self, limit):
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        self.limit = limit
+        self.active = 0
+        self.shed = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a slot, returns False if they are all in use"""
+        with self._lock:
+            if self.active >= self.limit:
+                self.shed += 1
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
@@ -0,0 +1,368 @@
+"""
+Offline load generator for :py:class:`AtlassianConnect` based addons.
+
+Creates a number of synthetic tenants through the ``installed`` lifecycle
+(answering the consumer-info lookup from a local stand-in server) and then
+drives signed ``webhook``, ``module`` and ``webpanel`` traffic at the addon,
+either in-process through the WSGI app or against a locally running server.
+
+Example::
+
+    from flask_atlassian_connect.loadtest import LoadTest
+    from app.web import app, ac
+
+    report = LoadTest(app, ac, tenants=50, concurrency=8).run(5000)
+    print(report)
+
+Or from the command line::
+
+    python -m flask_atlassian_connect.loadtest app.web --tenants 50 \\
+        --requests 5000 --concurrency 8
+"""
+import json
+import random
+import threading
+from importlib import import_module
+from time import perf_counter
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from .stats import percentile
+
+CONSUMER_INFO_PATH = '/plugins/servlet/oauth/consumer-info'
+PUBLIC_KEY = 'loadtest-public-key'
+SECTIONS = ('webhook', 'module', 'webpanel')
+
+_CONSUMER_INFO = """<?xml version="1.0" encoding="UTF-8"?>
+<consumer>
+<key>%s</key>
+<name>LoadTest</name>
+<publicKey>%s</publicKey>
+<description>Synthetic tenant %s</description>
+</consumer>"""
+
+
+class _ConsumerInfoHandler(BaseHTTPRequestHandler):
+    """Answers consumer-info for any ``/<clientKey>`` prefixed base url"""
+    def do_GET(self):
+        client_key, _, rest = self.path.lstrip('/').partition('/')
+        if '/' + rest != CONSUMER_INFO_PATH:
+            self.send_error(404)
+            return
+        body = (_CONSUMER_INFO % (client_key, PUBLIC_KEY, client_key)).encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        """Keep the load test output readable"""
+        pass
+
+
+class _ConsumerInfoServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class LoadTestReport(object):
+    """
+    Results of a :py:class:`LoadTest` run
+
+    :ivar requests: number of requests sent
+    :ivar errors: number of requests that failed or returned >= 400
+    :ivar duration: wall clock seconds spent sending traffic
+    :ivar latencies: dict of section to sorted latencies in seconds
+    :ivar statuses: dict of status code (or exception name) to count
+    """
+    def __init__(self, duration, latencies, statuses, errors):
+        self.duration = duration
+        self.latencies = dict(
+            (section, sorted(samples)) for section, samples in latencies.items())
+        self.statuses = statuses
+        self.errors = errors
+        self.requests = sum(len(v) for v in self.latencies.values())
+
+    @property
+    def throughput(self):
+        """Requests per second over the whole run"""
+        if not self.duration:
+            return 0.0
+        return self.requests / self.duration
+
+    def summary(self, section=None):
+        """
+        Latency summary in milliseconds
+
+        :param section:
+            Only summarize the given section, defaults to all traffic
+        :rtype: dict
+        """
+        if section is None:
+            samples = sorted(s for v in self.latencies.values() for s in v)
+        else:
+            samples = self.latencies.get(section, [])
+        return {
+            "count": len(samples),
+            "p50": percentile(samples, 50) * 1000,
+            "p90": percentile(samples, 90) * 1000,
+            "p99": percentile(samples, 99) * 1000,
+            "max": (samples[-1] if samples else 0.0) * 1000,
+        }
+
+    def as_dict(self):
+        """Report as plain data, suitable for json.dumps"""
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "duration": self.duration,
+            "throughput": self.throughput,
+            "statuses": dict((str(k), v) for k, v in self.statuses.items()),
+            "latency": dict(
+                [("all", self.summary())] +
+                [(section, self.summary(section)) for section in self.latencies]),
+        }
+
+    def __str__(self):
+        lines = [
+            "%d requests in %.2fs (%.1f req/s), %d errors" % (
+                self.requests, self.duration, self.throughput, self.errors),
+            "%-10s %8s %9s %9s %9s %9s" % (
+                'section', 'count', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms'),
+        ]
+        for section in ['all'] + sorted(self.latencies):
+            stats = self.summary(None if section == 'all' else section)
+            lines.append("%-10s %8d %9.2f %9.2f %9.2f %9.2f" % (
+                section, stats['count'], stats['p50'], stats['p90'],
+                stats['p99'], stats['max']))
+        return "\n".join(lines)
+
+
+class LoadTest(object):
+    """
+    Load generator for an :py:class:`AtlassianConnect` addon
+
+    :param app:
+        Flask application the addon is registered with
+    :type app: :py:class:`flask.Flask`
+
+    :param addon:
+        The addon whose handlers should receive traffic
+    :type addon: :py:class:`AtlassianConnect`
+
+    :param tenants:
+        How many synthetic tenants to install
+    :type tenants: int
+
+    :param concurrency:
+        How many threads send traffic at the same time
+    :type concurrency: int
+
+    :param mix:
+        Relative weight of each section, defaults to an even mix of
+        ``webhook``, ``module`` and ``webpanel``
+    :type mix: dict
+
+    :param server_url:
+        Send traffic to an already running server (eg http://127.0.0.1:5000)
+        instead of calling the WSGI app in-process
+    :type server_url: string
+    """
+    def __init__(self, app, addon, tenants=10, concurrency=4, mix=None,
+                 server_url=None, seed=None):
+        self.app = app
+        self.addon = addon
+        self.tenants = tenants
+        self.concurrency = concurrency
+        self.mix = mix or dict((section, 1) for section in SECTIONS)
+        self.server_url = server_url.rstrip('/') if server_url else None
+        self.random = random.Random(seed)
+        self.clients = []
+
+    def _targets(self):
+        """(section, method, url) for every registered handler, by section"""
+        targets = {}
+        for section in SECTIONS:
+            if not self.mix.get(section):
+                continue
+            for name in self.addon.sections.get(section, {}):
+                url = self.addon.handler_path(section, name)
+                if section == 'webpanel':
+                    url += '?issueKey=LOAD-1'
+                method = 'POST' if section == 'webhook' else 'GET'
+                targets.setdefault(section, []).append((method, url))
+        if not targets:
+            raise ValueError('No webhook, module or webpanel handlers to test')
+        return targets
+
+    def _transport(self):
+        """Returns a callable(method, url, headers, data) -> status code"""
+        if self.server_url:
+            from requests import Session
+            session = Session()
+
+            def _send(method, url, headers, data=None):
+                return session.request(
+                    method, self.server_url + url,
+                    headers=headers, data=data).status_code
+        else:
+            client = self.app.test_client()
+
+            def _send(method, url, headers, data=None):
+                return client.open(
+                    url, method=method, headers=headers, data=data).status_code
+        return _send
+
+    def install(self):
+        """
+        Install the synthetic tenants through the ``installed`` lifecycle
+
+        A local consumer-info stand-in is started for the duration of
+        the installs so no outside network access is needed.
+        """
+        from atlassian_jwt import encode_token
+
+        server = _ConsumerInfoServer(('127.0.0.1', 0), _ConsumerInfoHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            send = self._transport()
+            base = 'http://127.0.0.1:%d/' % server.server_address[1]
+            self.clients = []
+            for i in range(self.tenants):
+                client_key = 'loadtest-%d' % i
+                client = {
+                    "key": self.app.config.get('ADDON_KEY') or 'loadtest',
+                    "clientKey": client_key,
+                    "publicKey": PUBLIC_KEY,
+                    "sharedSecret": 'loadtest-secret-%d-%s' % (
+                        i, self.random.getrandbits(64)),
+                    "baseUrl": base + client_key,
+                    "productType": "jira",
+                    "eventType": "installed",
+                }
+                if 'installed' in self.addon.sections.get('lifecycle', {}):
+                    url = self.addon.handler_path('lifecycle', 'installed')
+                    # Signed in case a previous run already installed this key
+                    status = send('POST', url, {
+                        'Content-Type': 'application/json',
+                        'Authorization': 'JWT ' + encode_token(
+                            'POST', url, client_key, client['sharedSecret'])
+                    }, json.dumps(client))
+                    if status >= 400:
+                        raise RuntimeError(
+                            'Install of %s failed with %s' % (client_key, status))
+                else:
+                    self.addon.client_class.save(
+                        self.addon.client_class(**client))
+                self.clients.append(client)
+        finally:
+            server.shutdown()
+            server.server_close()
+        return self.clients
+
+    def run(self, requests=1000):
+        """
+        Install tenants (if not done yet) and send traffic
+
+        :param requests:
+            Total number of requests to send across all threads
+        :type requests: int
+        :rtype: :py:class:`LoadTestReport`
+        """
+        from atlassian_jwt import encode_token
+
+        if not self.clients:
+            self.install()
+        targets = self._targets()
+        sections = sorted(targets)
+        weights = [self.mix[section] for section in sections]
+        plan = []
+        for _ in range(requests):
+            section = self.random.choices(sections, weights)[0]
+            method, url = self.random.choice(targets[section])
+            plan.append((section, method, url, self.random.choice(self.clients)))
+
+        lock = threading.Lock()
+        latencies = dict((section, []) for section in sections)
+        statuses = {}
+        errors = [0]
+        remaining = iter(plan)
+
+        def _worker():
+            send = self._transport()
+            while True:
+                with lock:
+                    item = next(remaining, None)
+                if item is None:
+                    return
+                section, method, url, client = item
+                headers = {
+                    'Content-Type': 'application/json',
+                    'Authorization': 'JWT ' + encode_token(
+                        method, url, client['clientKey'], client['sharedSecret'])
+                }
+                data = None
+                if method == 'POST':
+                    data = json.dumps({
+                        "webhookEvent": url.rsplit('/', 1)[-1],
+                        "timestamp": 0,
+                    })
+                start = perf_counter()
+                try:
+                    status = send(method, url, headers, data)
+                except Exception as ex:  # pylint: disable=broad-except
+                    status = type(ex).__name__
+                elapsed = perf_counter() - start
+                with lock:
+                    latencies[section].append(elapsed)
+                    statuses[status] = statuses.get(status, 0) + 1
+                    if not isinstance(status, int) or status >= 400:
+                        errors[0] += 1
+
+        threads = [threading.Thread(target=_worker)
+                   for _ in range(max(1, self.concurrency))]
+        start = perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return LoadTestReport(perf_counter() - start, latencies, statuses, errors[0])
+
+
+def main(argv=None):
+    """Command line entry point, see ``--help``"""
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('module', help='Python module containing the addon')
+    parser.add_argument('--app', default='app',
+                        help='Name of the flask app in module (default: app)')
+    parser.add_argument('--addon', default='ac',
+                        help='Name of the AtlassianConnect in module (default: ac)')
+    parser.add_argument('--tenants', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--mix', default='webhook=1,module=1,webpanel=1',
+                        help='Relative weight per section')
+    parser.add_argument('--server-url',
+                        help='Target a running server instead of in-process')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--json', action='store_true',
+                        help='Print the report as json')
+    args = parser.parse_args(argv)
+
+    module = import_module(args.module)
+    mix = dict(
+        (k, float(v)) for k, v in (p.split('=') for p in args.mix.split(',')))
+    report = LoadTest(
+        getattr(module, args.app), getattr(module, args.addon),
+        tenants=args.tenants, concurrency=args.concurrency, mix=mix,
+        server_url=args.server_url, seed=args.seed).run(args.requests)
+    print(json.dumps(report.as_dict(), indent=2) if args.json else report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,21 @@
+"""Running handlers in worker processes, see ``webhook(..., process_pool=True)``"""
+
+
+def client_snapshot(addon, client):
+    """
+    Picklable copy of a client, with the plaintext shared secret
+
+    :returns: (client_class or None for dict clients, dict of attributes)
+    """
+    if isinstance(client, dict):
+        client_class, snapshot = None, dict(client)
+    else:
+        client_class, snapshot = addon.client_class, dict(vars(client))
+    snapshot['sharedSecret'] = addon.shared_secret(client)
+    return client_class, snapshot
+
+
+def call_with_client(func, client_class, snapshot, kwargs):
+    """Entry point in the worker process, rebuilds the client and calls func"""
+    client = snapshot if client_class is None else client_class(**snapshot)
+    return func(client=client, **kwargs)
@@ -0,0 +1,149 @@
+"""Low overhead stack sampling of slow requests"""
+import itertools
+import logging
+import os
+import re
+import sys
+import threading
+from collections import Counter
+from time import perf_counter, time
+
+logger = logging.getLogger(__name__)
+
+_UNSAFE_RE = re.compile(r'[^A-Za-z0-9._-]+')
+
+
+class _Recording(object):
+    __slots__ = ('start', 'stacks')
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.stacks = Counter()
+
+
+class SamplingProfiler(object):
+    """
+    Samples the stacks of in-flight requests and keeps the slow ones.
+
+    A single background thread looks at ``sys._current_frames()`` every
+    ``interval`` seconds, but only walks the threads that are serving a
+    request, so an idle or fast app pays next to nothing. When a request
+    took longer than ``threshold`` its samples are written to ``directory``
+    in collapsed stack format (one ``frame;frame;frame count`` line per
+    distinct stack), ready for flamegraph.pl or speedscope. The first frame
+    of every stack is the section, handler name and clientKey of the
+    request. Only the newest ``keep`` profiles are kept.
+
+    :param directory:
+        Where profiles are written, created if needed
+    :type directory: string
+
+    :param threshold:
+        Requests that take at least this many seconds are saved
+    :type threshold: float
+
+    :param interval:
+        Seconds between samples
+    :type interval: float
+
+    :param keep:
+        Number of profiles kept before the oldest are deleted
+    :type keep: int
+    """
+    def __init__(self, directory, threshold=1.0, interval=0.01, keep=100):
+        self.directory = directory
+        self.threshold = threshold
+        self.interval = interval
+        self.keep = keep
+        self.samples = 0
+        self._active = {}
+        self._labels = {}
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._stopped = threading.Event()
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    def begin(self):
+        """Start recording the current thread, returns the recording"""
+        recording = _Recording()
+        with self._lock:
+            self._active[threading.get_ident()] = recording
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='ac-profiler')
+                self._thread.daemon = True
+                self._thread.start()
+        return recording
+
+    def end(self, recording, section, name, client_key=None):
+        """
+        Stop recording the current thread, saving the profile if it was slow
+
+        :returns: path of the saved profile or None
+        """
+        elapsed = perf_counter() - recording.start
+        with self._lock:
+            self._active.pop(threading.get_ident(), None)
+        if elapsed < self.threshold or not recording.stacks:
+            return None
+        try:
+            return self._save(recording, elapsed, section, name, client_key)
+        except OSError:
+            logger.exception('Could not save profile')
+            return None
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            with self._lock:
+                if not self._active:
+                    continue
+                active = list(self._active.items())
+            frames = sys._current_frames()  # pylint: disable=protected-access
+            for ident, recording in active:
+                frame = frames.get(ident)
+                if frame is not None:
+                    recording.stacks[self._collapse(frame)] += 1
+            self.samples += 1
+
+    def _collapse(self, frame):
+        labels = self._labels
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            label = labels.get(code)
+            if label is None:
+                label = labels[code] = '%s (%s:%d)' % (
+                    code.co_name, os.path.basename(code.co_filename),
+                    code.co_firstlineno)
+            names.append(label)
+            frame = frame.f_back
+        names.reverse()
+        return ';'.join(names)
+
+    def _save(self, recording, elapsed, section, name, client_key):
+        root = '%s/%s [%s]' % (section, name, client_key or '-')
+        filename = '%.6f-%d-%s-%s-%s-%dms.folded' % (
+            time(), next(self._seq), section, name, client_key or '-',
+            elapsed * 1000)
+        path = os.path.join(self.directory, _UNSAFE_RE.sub('_', filename))
+        with open(path, 'w') as out:
+            for stack, count in recording.stacks.most_common():
+                out.write('%s;%s %d\n' % (root.replace(';', ','), stack, count))
+        self._prune()
+        return path
+
+    def _prune(self):
+        with self._lock:
+            profiles = sorted(
+                f for f in os.listdir(self.directory) if f.endswith('.folded'))
+            for old in profiles[:max(len(profiles) - self.keep, 0)]:
+                try:
+                    os.remove(os.path.join(self.directory, old))
+                except OSError:
+                    pass
@@ -0,0 +1,263 @@
+"""
+Client store for anything that speaks the Redis protocol (Redis, KeyDB,
+Valkey, Dragonfly, ...), with no dependency beyond the standard library.
+
+Example::
+
+    from flask_atlassian_connect.redis_client import RedisClient
+
+    class Client(RedisClient):
+        pass
+
+    Client.connect('redis://localhost:6379/0')
+    ac = AtlassianConnect(app, client_class=Client)
+"""
+import json
+import socket
+import threading
+from contextlib import contextmanager
+from urllib.parse import unquote, urlparse
+
+from .client import AtlassianConnectClient
+
+
+class RedisError(Exception):
+    """Error reply from the server"""
+
+
+def _encode(arg):
+    if isinstance(arg, bytes):
+        return arg
+    if not isinstance(arg, str):
+        arg = str(arg)
+    return arg.encode('utf8')
+
+
+def pack_commands(commands):
+    """RESP encoding of a list of commands, ready to be sent in one write"""
+    out = []
+    for command in commands:
+        out.append(b'*%d\r\n' % len(command))
+        for arg in command:
+            arg = _encode(arg)
+            out.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+    return b''.join(out)
+
+
+class Connection(object):
+    """
+    One socket to the server, replies are read from a buffered reader.
+    Raises :py:class:`RedisError` if authentication or selecting the
+    database fails.
+    """
+    def __init__(self, host, port, db=0, password=None, timeout=5,
+                 username=None):
+        self.sock = socket.create_connection((host, port), timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile('rb')
+        setup = []
+        if password and username:
+            setup.append(('AUTH', username, password))
+        elif password:
+            setup.append(('AUTH', password))
+        if db:
+            setup.append(('SELECT', db))
+        if setup:
+            try:
+                for reply in self.execute(setup):
+                    if isinstance(reply, RedisError):
+                        raise reply
+            except BaseException:
+                self.close()
+                raise
+
+    def execute(self, commands):
+        """
+        Send every command before reading any reply (pipelining)
+
+        :returns: one reply per command, error replies are returned as
+            :py:class:`RedisError` instances rather than raised
+        """
+        self.sock.sendall(pack_commands(commands))
+        return [self.read_reply() for _ in commands]
+
+    def read_reply(self):
+        line = self.reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError('connection closed by server')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode('utf8')
+        if kind == b'-':
+            return RedisError(rest.decode('utf8'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(rest)
+            if length < 0:
+                return None
+            return [self.read_reply() for _ in range(length)]
+        raise RedisError('unknown reply type %r' % kind)
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class ConnectionPool(object):
+    """
+    Reuses idle connections, at most ``max_idle`` of them are kept open.
+    A connection that fails mid command is closed rather than returned.
+    """
+    def __init__(self, url='redis://localhost:6379/0', max_idle=16, timeout=5):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.username = unquote(parsed.username) if parsed.username else None
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = Connection(self.host, self.port, self.db,
+                              self.password, self.timeout, self.username)
+        try:
+            yield conn
+        except BaseException:
+            # the connection may have unread replies, never reuse it
+            conn.close()
+            raise
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                conn = None
+        if conn is not None:
+            conn.close()
+
+    def execute(self, *command):
+        """Run a single command, raising error replies"""
+        return self.pipeline([command])[0]
+
+    def pipeline(self, commands):
+        """Run commands in one round trip, raising the first error reply"""
+        if not commands:
+            return []
+        with self.connection() as conn:
+            replies = conn.execute(commands)
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class RedisClient(AtlassianConnectClient):
+    """
+    Client stored as JSON under ``<prefix><clientKey>``.
+
+    Call :py:meth:`connect` once at startup. Besides the usual
+    ``load``/``save``/``delete``/``all`` there are :py:meth:`load_many` and
+    :py:meth:`save_many`, which cost a single round trip for any number of
+    clients, and ``all()`` streams clients with ``SCAN`` instead of
+    fetching every key at once.
+    """
+    pool = None
+    prefix = 'ac:client:'
+    scan_count = 500
+
+    @classmethod
+    def connect(cls, url='redis://localhost:6379/0', prefix=None, **kwargs):
+        """Point this client class at a server"""
+        cls.pool = ConnectionPool(url, **kwargs)
+        if prefix is not None:
+            cls.prefix = prefix
+        return cls.pool
+
+    @classmethod
+    def _key(cls, client_key):
+        return cls.prefix + client_key
+
+    @classmethod
+    def _from_json(cls, data):
+        if data is None:
+            return None
+        return cls(**json.loads(data.decode('utf8')))
+
+    @staticmethod
+    def _to_json(client):
+        if not isinstance(client, dict):
+            client = vars(client)
+        return json.dumps(client, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, client_key):
+        return cls._from_json(cls.pool.execute('GET', cls._key(client_key)))
+
+    @classmethod
+    def load_many(cls, client_keys):
+        """
+        Clients for several clientKeys with one ``MGET``
+
+        :returns: list with None for unknown clientKeys
+        """
+        client_keys = list(client_keys)
+        if not client_keys:
+            return []
+        replies = cls.pool.execute('MGET', *[cls._key(k) for k in client_keys])
+        return [cls._from_json(data) for data in replies]
+
+    @classmethod
+    def save(cls, client):
+        key = client['clientKey'] if isinstance(client, dict) else client.clientKey
+        cls.pool.execute('SET', cls._key(key), cls._to_json(client))
+
+    @classmethod
+    def save_many(cls, clients):
+        """Save several clients in one pipelined round trip"""
+        cls.pool.pipeline([
+            ('SET', cls._key(c['clientKey'] if isinstance(c, dict) else c.clientKey),
+             cls._to_json(c))
+            for c in clients])
+
+    @classmethod
+    def delete(cls, client_key):
+        cls.pool.execute('DEL', cls._key(client_key))
+
+    @classmethod
+    def all(cls):
+        """Generator over every stored client, fetched in SCAN sized batches"""
+        cursor = b'0'
+        while True:
+            cursor, keys = cls.pool.execute(
+                'SCAN', cursor, 'MATCH', cls.prefix + '*', 'COUNT', cls.scan_count)
+            if keys:
+                for data in cls.pool.execute('MGET', *keys):
+                    # keys can disappear between SCAN and MGET
+                    if data is not None:
+                        yield cls._from_json(data)
+            if cursor == b'0':
+                return
+
+    def __iter__(self):
+        return iter(vars(self).items())
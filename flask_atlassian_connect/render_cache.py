@@ -0,0 +1,78 @@
+"""Opt-in caching of module and webpanel renders"""
+import hashlib
+
+from flask import current_app, request
+from werkzeug.http import is_hop_by_hop_header
+
+from .cache import LRUCache
+
+# set on every cached response by respond() itself
+_REBUILT_HEADERS = frozenset(
+    ('content-length', 'content-type', 'etag', 'cache-control'))
+
+
+def default_cache_key(client, args):
+    """Every request argument except the jwt"""
+    del client
+    return tuple(sorted(
+        (k, v) for k, v in args.items(multi=True) if k != 'jwt'))
+
+
+class RenderCache(object):
+    """
+    Caches successful renders of one handler per tenant.
+
+    Repeat requests with the same key skip the handler entirely, and
+    browsers that send back the ETag get a 304 without a body.
+
+    Rendered pages that contain signed urls (eg ``atlassian_jwt_post_url``)
+    carry those signatures along, so keep ``ttl`` well below their expiry.
+    Headers the handler sets are replayed with the body, responses that set
+    cookies are not cached.
+
+    :param ttl:
+        Seconds a render stays cached
+    :type ttl: float
+
+    :param key:
+        callable(client, args) returning a hashable cache key for the
+        request, or None to not cache it. Defaults to all request arguments
+        except the jwt. The clientKey and the user (the JWT ``sub``) are
+        always part of the key.
+
+    :param maxsize:
+        Renders kept before the least recently used one is dropped
+    :type maxsize: int
+    """
+    def __init__(self, ttl, key=None, maxsize=1024):
+        self.key = key or default_cache_key
+        self.renders = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def respond(self, client_key, user, client, render):
+        """Cached response for the request, calling render() on a miss"""
+        key = self.key(client, request.args)
+        if key is None:
+            return render()
+        key = (client_key, user, key)
+
+        cached = self.renders.get(key)
+        if cached is None:
+            response = current_app.make_response(render())
+            if (response.status_code != 200 or response.is_streamed or
+                    'Set-Cookie' in response.headers):
+                return response
+            body = response.get_data()
+            headers = [(name, value) for name, value in response.headers
+                       if name.lower() not in _REBUILT_HEADERS and
+                       not is_hop_by_hop_header(name)]
+            cached = (body, response.mimetype, headers,
+                      hashlib.sha1(body).hexdigest())
+            self.renders.set(key, cached)
+
+        body, mimetype, headers, etag = cached
+        response = current_app.response_class(
+            body, mimetype=mimetype, headers=headers)
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
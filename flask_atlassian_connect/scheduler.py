@@ -0,0 +1,175 @@
+"""Periodic per tenant jobs, see :py:meth:`AtlassianConnect.periodic`"""
+import heapq
+import itertools
+import logging
+import random
+import threading
+import zlib
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+from flask import g
+
+from .context import TenantContext
+
+logger = logging.getLogger(__name__)
+
+PeriodicJob = namedtuple('PeriodicJob', ['name', 'interval', 'func'])
+
+
+def _slot(name, client_key):
+    """Stable fraction in [0, 1) for a job and tenant"""
+    return zlib.crc32((name + '\0' + client_key).encode('utf8')) / 2.0 ** 32
+
+
+def _enabled(client):
+    if isinstance(client, dict):
+        return client.get('enabled') is not False
+    return getattr(client, 'enabled', None) is not False
+
+
+class Scheduler(object):
+    """
+    Runs every periodic job once per interval for every tenant.
+
+    Each tenant gets a fixed slot within the interval, derived from a hash
+    of the job name and clientKey, plus up to ``jitter`` of the interval of
+    random delay, so work is spread out instead of every tenant running on
+    the hour. Slots are aligned to the wall clock, so restarts do not move
+    them. Missed runs are skipped rather than caught up.
+
+    Tenants come from ``ac.tenants``, checked for new ones every
+    ``refresh`` seconds. That index is rebuilt from a full scan of the
+    client store (through the store guard, if enabled) when the scheduler
+    starts and then every ``rescan`` seconds, to pick up tenants that were
+    installed through other processes. Each client is loaded when its job
+    is due. Disabled tenants (``enabled`` is False, see the ``enabled`` and
+    ``disabled`` lifecycle callbacks) are skipped, uninstalled ones are
+    dropped. At most ``tenant_limit`` jobs run at once per tenant, jobs
+    over the limit wait for the next tick.
+
+    Jobs run on a pool of ``workers`` threads inside an app context, with
+    ``g.ac_context`` set up as in a request.
+    """
+    def __init__(self, addon, app, workers=4, tenant_limit=1, jitter=0.1,
+                 refresh=60, rescan=3600, tick=1.0, timer=time):
+        self.addon = addon
+        self.app = app
+        self.tenant_limit = tenant_limit
+        self.jitter = jitter
+        self.refresh = refresh
+        self.rescan = rescan
+        self.tick = tick
+        self._timer = timer
+        self._heap = []
+        self._scheduled = set()
+        self._running = Counter()
+        self._refreshed = None
+        self._scanned = None
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='ac-periodic')
+
+    def start(self):
+        """Call :py:meth:`run_pending` every ``tick`` seconds in the background"""
+        self._thread = threading.Thread(target=self._run, name='ac-scheduler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._pool.shutdown()
+
+    def _run(self):
+        while not self._stopped.wait(self.tick):
+            try:
+                self.run_pending()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Periodic job scheduling failed')
+
+    def run_pending(self, now=None):
+        """
+        Start every job that is due
+
+        :returns: futures of the started jobs
+        """
+        now = self._timer() if now is None else now
+        if self._refreshed is None or now - self._refreshed >= self.refresh:
+            self._load_tenants(now)
+
+        jobs = self.addon.periodic_jobs
+        tenants = self.addon.tenants
+        started, deferred = [], []
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            _, due, _, index, client_key = entry
+            enabled = tenants.is_enabled(client_key)
+            if enabled is None:
+                self._scheduled.discard((index, client_key))
+                continue
+            job = jobs[index]
+            if enabled:
+                with self._lock:
+                    if self._running[client_key] >= self.tenant_limit:
+                        deferred.append(entry)
+                        continue
+                    self._running[client_key] += 1
+                started.append(self._pool.submit(self._call, job, client_key))
+            self._schedule(index, client_key, due, job.interval, now)
+        for _, due, _, index, client_key in deferred:
+            # try again next tick rather than on this one
+            heapq.heappush(self._heap, (
+                now + self.tick, due, next(self._seq), index, client_key))
+        return started
+
+    def _load_tenants(self, now):
+        if self._scanned is None or now - self._scanned >= self.rescan:
+            with self.app.app_context():
+                self.addon.tenants.rebuild(self.addon._all_clients())
+            self._scanned = now
+        self._refreshed = now
+
+        for index, job in enumerate(self.addon.periodic_jobs):
+            for client_key in self.addon.tenants.client_keys():
+                if (index, client_key) in self._scheduled:
+                    continue
+                self._scheduled.add((index, client_key))
+                offset = _slot(job.name, client_key) * job.interval
+                due = now + (offset - now) % job.interval
+                self._push(index, client_key, due, job.interval)
+
+    def _schedule(self, index, client_key, due, interval, now):
+        due += interval
+        if due <= now:
+            due += (now - due) // interval * interval + interval
+        self._push(index, client_key, due, interval)
+
+    def _push(self, index, client_key, due, interval):
+        run_at = due + random.uniform(0, self.jitter * interval)
+        heapq.heappush(
+            self._heap, (run_at, due, next(self._seq), index, client_key))
+
+    def _call(self, job, client_key):
+        try:
+            with self.app.app_context():
+                client = self.addon._load_client(client_key)
+                if client is None:
+                    # uninstalled, dropped when it is next due
+                    self.addon.tenants.remove(client_key)
+                    return None
+                if not _enabled(client):
+                    return None
+                g.ac_client = client
+                g.ac_context = TenantContext(self.addon, client, client_key)
+                return job.func(client=client)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('Periodic job %s failed for %s', job.name, client_key)
+        finally:
+            with self._lock:
+                self._running[client_key] -= 1
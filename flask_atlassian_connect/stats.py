@@ -0,0 +1,9 @@
+"""Summary statistics shared by the load generator and the store guard"""
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of an already sorted list of samples"""
+    if not samples:
+        return 0.0
+    rank = int(round(pct / 100.0 * (len(samples) - 1)))
+    return samples[min(max(rank, 0), len(samples) - 1)]
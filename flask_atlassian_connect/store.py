@@ -0,0 +1,192 @@
+"""Timeouts, circuit breaking and latency tracking around the client store"""
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as _Timeout
+from time import monotonic, perf_counter
+
+from flask import current_app, has_app_context
+
+from .cache import LRUCache
+from .stats import percentile
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class StoreUnavailable(Exception):
+    """The client store can not be reached and there is nothing to fall back on"""
+
+
+class CircuitBreaker(object):
+    """
+    Stops calling a failing dependency for a while.
+
+    After ``failure_threshold`` consecutive failures the breaker opens and
+    :py:meth:`allow` refuses calls. Once ``reset_timeout`` seconds have
+    passed a single trial call is let through (half-open), which either
+    closes the breaker again or re-opens it.
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=30, timer=monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._timer = timer
+        self._opened = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened is None:
+            return CLOSED
+        if self._timer() - self._opened >= self.reset_timeout:
+            return HALF_OPEN
+        return OPEN
+
+    def allow(self):
+        """Whether a call may be attempted now"""
+        with self._lock:
+            state = self._state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self._opened = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                self._opened = self._timer()
+            self._trial = False
+
+
+class StoreGuard(object):
+    """
+    Wraps ``client_class`` calls with a timeout and a :py:class:`CircuitBreaker`.
+
+    Every client that is loaded or saved is remembered in a bounded
+    last-known-good snapshot. While the store is failing, or the breaker is
+    open, loads are answered from that snapshot so tenants that were seen
+    recently keep working. Writes are never faked and raise
+    :py:class:`StoreUnavailable` instead.
+
+    :param client_class:
+        The addon's client class
+    :param timeout:
+        Seconds to wait for a single store call
+    :type timeout: float
+    :param failure_threshold:
+        Consecutive failures that open the breaker
+    :type failure_threshold: int
+    :param reset_timeout:
+        Seconds the breaker stays open before a trial call
+    :type reset_timeout: float
+    :param snapshot_size:
+        Clients kept in the last-known-good snapshot
+    :type snapshot_size: int
+    :param workers:
+        Threads store calls are run on. Calls that time out keep their
+        thread until the store answers.
+    :type workers: int
+    """
+    def __init__(self, client_class, timeout=1.0, failure_threshold=5,
+                 reset_timeout=30, snapshot_size=10000, workers=8,
+                 samples=1024):
+        self.client_class = client_class
+        self.timeout = timeout
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.snapshot = LRUCache(snapshot_size)
+        self.fallbacks = 0
+        self._latencies = deque(maxlen=samples)
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='ac-store')
+
+    def load(self, client_key):
+        """client_class.load, falling back to the snapshot"""
+        try:
+            client = self._call(self.client_class.load, client_key)
+        except StoreUnavailable:
+            client = self.snapshot.get(client_key)
+            if client is None:
+                raise
+            self.fallbacks += 1
+            return client
+        if client is not None:
+            self.snapshot.set(client_key, client)
+        return client
+
+    def all(self):
+        """client_class.all, a failing store is raised rather than faked"""
+        return self._call(self.client_class.all)
+
+    def save(self, client_key, client):
+        self._call(self.client_class.save, client)
+        self.snapshot.set(client_key, client)
+
+    def delete(self, client_key):
+        self.snapshot.pop(client_key)
+        self._call(self.client_class.delete, client_key)
+
+    def _call(self, func, *args):
+        if not self.breaker.allow():
+            raise StoreUnavailable('client store circuit is open')
+
+        app = current_app._get_current_object() if has_app_context() else None
+
+        def _run():
+            if app is None:
+                return func(*args)
+            with app.app_context():
+                return func(*args)
+
+        start = perf_counter()
+        try:
+            result = self._pool.submit(_run).result(self.timeout)
+        except Exception as ex:  # pylint: disable=broad-except
+            self._latencies.append(perf_counter() - start)
+            self.breaker.failure()
+            if isinstance(ex, _Timeout):
+                logger.warning('client store %s timed out', func.__name__)
+            else:
+                logger.exception('client store %s failed', func.__name__)
+            raise StoreUnavailable('client store %s failed' % func.__name__) from ex
+        self._latencies.append(perf_counter() - start)
+        self.breaker.success()
+        return result
+
+    def latency(self):
+        """Percentiles of recent store call latencies, in milliseconds"""
+        samples = sorted(self._latencies)
+        return dict(
+            count=len(samples),
+            **{'p%d' % pct: round(percentile(samples, pct) * 1000, 3)
+               for pct in (50, 95, 99)})
+
+    def health(self):
+        """Summary served by the health endpoint"""
+        return {
+            "state": self.breaker.state,
+            "failures": self.breaker.failures,
+            "fallbacks": self.fallbacks,
+            "snapshot": len(self.snapshot),
+            "latency": self.latency(),
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
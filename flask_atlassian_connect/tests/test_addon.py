@@ -1,11 +1,24 @@
+import gzip
+import threading
+import time
 import unittest
 import json
+from html import unescape
+import jwt
+import mock
 import requests_mock
 import requests
-from flask import Flask, render_template_string
-from .. import AtlassianConnect
+from flask import Flask, render_template_string, request
+from .. import AtlassianConnect, base
 from ..base import AtlassianConnectClient
+from ..tokens import unverified_claims
 from atlassian_jwt.encode import encode_token
+from atlassian_jwt.url_utils import hash_url
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 consumer_info_response = """<?xml version="1.0" encoding="UTF-8"?>
     <consumer>
@@ -96,6 +109,116 @@ class ACFlaskTestCase(unittest.TestCase):
             json.loads(response.get_data())['authentication']
         )
 
+    def test_descriptor_profiles(self):
+        """Named descriptor variants share handlers but not descriptors"""
+        self.ac.module(name="Configure", key="configurePage")(decorator_noop)
+        self.ac.webpanel(key="userPanel")(decorator_noop)
+        self.ac.webhook('jira:issue_created')(decorator_noop)
+        self.ac.descriptor_profile(
+            "confluence", key="confluence-addon", scopes=["READ", "WRITE"],
+            modules=["configurePage", "jira:issue_created"])
+
+        response = self.client.get('/atlassian_connect/descriptor/confluence')
+        self.assertEqual(200, response.status_code)
+        descriptor = json.loads(response.get_data(as_text=True))
+        self.assertEqual("confluence-addon", descriptor["key"])
+        self.assertEqual(["READ", "WRITE"], descriptor["scopes"])
+        self.assertEqual(
+            set(["configurePage", "webhooks"]), set(descriptor["modules"]))
+        self.assertEqual("http://localhost", descriptor["baseUrl"])
+        self.assertEqual("http://localhost/atlassian_connect/descriptor/confluence",
+                         descriptor["links"]["self"])
+        self.assertIn("installed", descriptor["lifecycle"])
+
+        descriptor = json.loads(self.client.get(
+            '/atlassian_connect/descriptor').get_data(as_text=True))
+        self.assertEqual(["READ"], descriptor["scopes"])
+        self.assertIn("webPanels", descriptor["modules"])
+        self.assertEqual("http://localhost/atlassian_connect/descriptor",
+                         descriptor["links"]["self"])
+
+        self.assertEqual(404, self.client.get(
+            '/atlassian_connect/descriptor/nope').status_code)
+
+    def test_descriptor_cache(self):
+        """The serialized descriptor is reused until something is registered"""
+        first = self.client.get('/atlassian_connect/descriptor').get_data()
+        self.assertEqual(first, self.client.get(
+            '/atlassian_connect/descriptor').get_data())
+        self.assertEqual(1, len(self.ac._descriptor_cache))
+
+        self.ac.module(key="configurePage")(decorator_noop)
+        descriptor = json.loads(self.client.get(
+            '/atlassian_connect/descriptor').get_data(as_text=True))
+        self.assertIn("configurePage", descriptor["modules"])
+
+        self.ac.descriptor = dict(self.ac.descriptor, name="Renamed")
+        descriptor = json.loads(self.client.get(
+            '/atlassian_connect/descriptor').get_data(as_text=True))
+        self.assertEqual("Renamed", descriptor["name"])
+
+        self.ac.descriptor["name"] = "Changed in place"
+        self.ac.invalidate_descriptor()
+        descriptor = json.loads(self.client.get(
+            '/atlassian_connect/descriptor').get_data(as_text=True))
+        self.assertEqual("Changed in place", descriptor["name"])
+
+    def test_descriptor_hosts(self):
+        """Every host gets its own baseUrl from the one cached descriptor"""
+        for host in ('one.example.com', 'two.example.com', 'two.example.com:8080'):
+            descriptor = json.loads(self.client.get(
+                '/atlassian_connect/descriptor',
+                base_url='https://%s' % host).get_data(as_text=True))
+            self.assertEqual('https://%s' % host, descriptor["baseUrl"])
+            self.assertEqual('https://%s/atlassian_connect/descriptor' % host,
+                             descriptor["links"]["self"])
+        self.assertEqual(1, len(self.ac._descriptor_cache))
+
+    def test_descriptor_compression(self):
+        """Pre-compressed descriptor variants are picked by Accept-Encoding"""
+        plain = self.client.get('/atlassian_connect/descriptor')
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertIn('Accept-Encoding', plain.headers['Vary'])
+
+        response = self.client.get('/atlassian_connect/descriptor',
+                                   headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual('gzip', response.headers['Content-Encoding'])
+        self.assertEqual(plain.get_data(), gzip.decompress(response.get_data()))
+
+        response = self.client.get('/atlassian_connect/descriptor',
+                                   headers={'Accept-Encoding': 'deflate'})
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_descriptor_compressed_once(self):
+        """Compressed variants are kept for a few hosts each"""
+        def _get(host):
+            return self.client.get('/atlassian_connect/descriptor',
+                                   base_url='https://' + host,
+                                   headers={'Accept-Encoding': 'gzip'})
+
+        with mock.patch('flask_atlassian_connect.base._compressed_variants',
+                        wraps=base._compressed_variants) as compress:
+            for host in ('localhost', 'one.example.com', 'localhost', 'one.example.com'):
+                response = _get(host)
+                self.assertEqual('gzip', response.content_encoding)
+                self.assertIn(b'https://' + host.encode(),
+                              gzip.decompress(response.get_data()))
+            self.assertEqual(2, compress.call_count)
+
+            for i in range(base._DESCRIPTOR_BASE_URLS):
+                _get('host%d.example.com' % i)
+            _get('localhost')
+        self.assertEqual(3 + base._DESCRIPTOR_BASE_URLS, compress.call_count)
+
+    @unittest.skipUnless(brotli, "brotli is not installed")
+    def test_descriptor_brotli(self):
+        response = self.client.get('/atlassian_connect/descriptor',
+                                   headers={'Accept-Encoding': 'gzip, br'})
+        self.assertEqual('br', response.headers['Content-Encoding'])
+        self.assertEqual(
+            self.client.get('/atlassian_connect/descriptor').get_data(),
+            brotli.decompress(response.get_data()))
+
     @unittest.skip("slow")
     def test_descriptor_should_validate(self):
         rv = self.client.get('/atlassian_connect/descriptor')
@@ -193,6 +316,98 @@ class ACFlaskTestCase(unittest.TestCase):
                               headers={'Authorization': 'JWT ' + auth})
         self.assertEqual(401, rv.status_code)
 
+    def test_lifecycle_installed_concurrent(self):
+        """Concurrent identical installs share one verification and save"""
+        installs = []
+        self.ac.lifecycle('installed')(
+            lambda client: installs.append(client) or ('', 204))
+        barrier = threading.Barrier(5)
+
+        def _consumer_info(request, context):
+            time.sleep(0.2)
+            return consumer_info_response
+
+        client = dict(
+            baseUrl='https://gavindev.atlassian.net',
+            clientKey='abc123',
+            publicKey='public123',
+            sharedSecret='myscret')
+        statuses = []
+
+        def _install():
+            test_client = self.app.test_client()
+            barrier.wait()
+            statuses.append(test_client.post(
+                '/atlassian_connect/lifecycle/installed',
+                data=json.dumps(client),
+                content_type='application/json').status_code)
+
+        with requests_mock.mock() as m:
+            m.get('https://gavindev.atlassian.net/plugins/servlet/oauth/consumer-info',
+                  text=_consumer_info)
+            threads = [threading.Thread(target=_install) for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(1, m.call_count)
+        self.assertEqual([204] * 5, statuses)
+        self.assertEqual(1, len(installs))
+
+        # Once done, a new unsigned install is a second install again
+        with requests_mock.mock() as m:
+            m.get('https://gavindev.atlassian.net/plugins/servlet/oauth/consumer-info',
+                  text=consumer_info_response)
+            rv = self.client.post('/atlassian_connect/lifecycle/installed',
+                                  data=json.dumps(client),
+                                  content_type='application/json')
+        self.assertEqual(401, rv.status_code)
+
+    def test_lifecycle_reinstall_concurrent(self):
+        """Separately signed re-installs are coalesced, each token is checked"""
+        installs = []
+        self.ac.lifecycle('installed')(
+            lambda client: installs.append(client) or self.app.response_class(
+                'installed', headers={'X-Install': '1'}))
+        client = dict(
+            baseUrl='https://gavindev.atlassian.net',
+            clientKey='abc123',
+            publicKey='public123',
+            sharedSecret='myscret')
+        _TestClient.save(_TestClient(**client))
+        url = '/atlassian_connect/lifecycle/installed'
+        secrets = ['myscret'] * 4 + ['wrong']
+        barrier = threading.Barrier(len(secrets))
+        responses = {}
+
+        def _consumer_info(request, context):
+            time.sleep(0.2)
+            return consumer_info_response
+
+        def _install(i, secret):
+            token = encode_token('POST', url, 'abc123', secret, timeout_secs=60 + i)
+            test_client = self.app.test_client()
+            barrier.wait()
+            responses[i] = test_client.post(
+                url, data=json.dumps(client), content_type='application/json',
+                headers={'Authorization': 'JWT ' + token})
+
+        with requests_mock.mock() as m:
+            m.get('https://gavindev.atlassian.net/plugins/servlet/oauth/consumer-info',
+                  text=_consumer_info)
+            threads = [threading.Thread(target=_install, args=(i, secret))
+                       for i, secret in enumerate(secrets)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(1, m.call_count)
+        self.assertEqual([200] * 4 + [401],
+                         [responses[i].status_code for i in range(len(secrets))])
+        self.assertEqual(['1'] * 4, [responses[i].headers.get('X-Install')
+                                     for i in range(4)])
+        self.assertEqual(1, len(installs))
+
     def test_webook(self):
         self.ac.webhook('jira:issue_created', filter="project is 'IM'")(
             decorator_noop)
@@ -265,6 +480,293 @@ class ACFlaskTestCase(unittest.TestCase):
             "/atlassian_connect/module/configurePage")
         self.assertEqual(204, response.status_code)
 
+    def test_post_url_round_trip(self):
+        """The signed post url in templates is accepted when posted back"""
+        self.ac.webpanel(key="aString")(decorator_a_string)
+        response = self._request_get(
+            'test_post_url_round_trip',
+            '/atlassian_connect/webpanel/aString?issueKey=TEST-1&other=a%20b')
+        self.assertEqual(200, response.status_code)
+        url = unescape(response.get_data(as_text=True).split('URL: ')[1])
+        self.assertIn('issueKey=TEST-1', url)
+        self.assertEqual(1, url.count('jwt='))
+
+        response = self.client.post(url)
+        self.assertEqual(200, response.status_code)
+
+    def test_sign_urls(self):
+        """Batch signing for the current client, cached per request"""
+        def _links(**kwargs):
+            return render_template_string(
+                '{{ atlassian_jwt_sign_url("/atlassian_connect/module/a") }}\n'
+                '{{ atlassian_jwt_sign_urls(["/x?y=1", ("POST", "/z")])|join("\n") }}')
+        self.ac.module(key="links")(_links)
+
+        response = self._request_get(
+            'test_sign_urls', '/atlassian_connect/module/links')
+        self.assertEqual(200, response.status_code)
+        links = unescape(response.get_data(as_text=True)).split('\n')
+        self.assertTrue(links[0].startswith('/atlassian_connect/module/a?jwt='))
+        self.assertTrue(links[1].startswith('/x?y=1&jwt='))
+        self.assertTrue(links[2].startswith('/z?jwt='))
+
+        client = _TestClient.load('test_sign_urls')
+        token = links[2].split('jwt=')[1]
+        claims = self.ac.token_contexts.get(
+            client.clientKey, client.sharedSecret).decode(
+                token, audience=client.clientKey)
+        self.assertEqual(hash_url('POST', '/z'), claims['qsh'])
+
+        self.ac.descriptor['key'] = 'test-addon'
+        with self.app.test_request_context('/'):
+            product = client.baseUrl + '/rest/api/2/issue/TEST-1'
+            first, second = self.ac.sign_urls(
+                [product, product], expires_in=60, client=client)
+            self.assertIs(first, second)
+            claims = unverified_claims(first.split('jwt=')[1])
+            self.assertEqual(hash_url('GET', '/rest/api/2/issue/TEST-1'),
+                             claims['qsh'])
+            self.assertEqual(60, claims['exp'] - claims['iat'])
+            # tokens for the product are issued by the addon
+            self.assertEqual('test-addon', claims['iss'])
+            self.assertNotIn('aud', claims)
+            self.ac.token_contexts.get(client.clientKey, client.sharedSecret).decode(
+                first.split('jwt=')[1])
+            addon_claims = unverified_claims(self.ac.sign_url(
+                '/atlassian_connect/module/a', client=client).split('jwt=')[1])
+            self.assertEqual(client.clientKey, addon_claims['iss'])
+            self.assertEqual(client.clientKey, addon_claims['aud'])
+            with self.assertRaises(ValueError):
+                self.ac.sign_url('/nope')
+
+    def test_tenant_context(self):
+        """Handlers and templates share one request scoped tenant context"""
+        seen = {}
+
+        def _handler(client, **kwargs):
+            seen['context'] = self.ac.context
+            return render_template_string(
+                '{{ ac_context.client_key }} {{ ac_context.account_id }}')
+        self.ac.module(key="context")(_handler)
+
+        client = _TestClient(
+            baseUrl='https://gavindev.atlassian.net/',
+            clientKey='test_tenant_context',
+            sharedSecret='myscret')
+        _TestClient.save(client)
+        url = '/atlassian_connect/module/context?a=1'
+        token = self.ac.token_contexts.get(client.clientKey, client.sharedSecret).encode({
+            'iss': client.clientKey, 'aud': client.clientKey,
+            'qsh': hash_url('GET', url), 'sub': 'account-1',
+            'context': {'jira': {'issue': {'key': 'TEST-1'}}},
+        })
+        response = self.client.get(url, headers={'Authorization': 'JWT ' + token})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('test_tenant_context account-1',
+                         response.get_data(as_text=True))
+
+        context = seen['context']
+        self.assertIs(client, context.client)
+        self.assertEqual(token, context.token)
+        self.assertEqual('TEST-1', context.product_context['jira']['issue']['key'])
+        self.assertEqual('https://gavindev.atlassian.net', context.base_url)
+        self.assertEqual('https://gavindev.atlassian.net/rest/api/2/myself',
+                         context.product_url('/rest/api/2/myself'))
+        self.assertIs(context.token_context, self.ac.token_contexts.get(
+            client.clientKey, client.sharedSecret))
+        with self.app.test_request_context(url):
+            self.assertEqual(url, context.url)
+            self.assertEqual(hash_url('GET', url), context.qsh)
+            self.assertIsNone(self.ac.context)
+
+    def test_verified_claims(self):
+        """Handlers get the verified claims without another decode or load"""
+        seen = {}
+
+        def _handler(client, **kwargs):
+            seen['claims'] = self.ac.context.claims
+        self.ac.webpanel(key="claims")(_handler)
+
+        with mock.patch.object(_TestClient, 'load', wraps=_TestClient.load) as load, \
+                mock.patch('flask_atlassian_connect.tokens.unverified_claims') as decode:
+            response = self._request_get(
+                'test_verified_claims',
+                '/atlassian_connect/webpanel/claims?issueKey=TEST-1')
+            self.assertEqual(204, response.status_code)
+            self.assertEqual(1, load.call_count)
+            decode.assert_not_called()
+        self.assertEqual('test_verified_claims', seen['claims']['iss'])
+        self.assertIn('qsh', seen['claims'])
+
+    def test_render_cache(self):
+        """Cached webpanel renders skip the handler and support ETags"""
+        renders = []
+
+        def _panel(client, **kwargs):
+            renders.append(request.args['issueKey'])
+            return 'issue %s' % request.args['issueKey']
+        self.ac.webpanel(key="cached", cache_ttl=60)(_panel)
+
+        url = '/atlassian_connect/webpanel/cached?issueKey=TEST-1'
+        first = self._request_get('test_render_cache', url)
+        self.assertEqual(200, first.status_code)
+        self.assertEqual('issue TEST-1', first.get_data(as_text=True))
+        self.assertTrue(first.headers['ETag'])
+        self.assertIn('private', first.headers['Cache-Control'])
+
+        second = self._request_get('test_render_cache', url)
+        self.assertEqual(first.get_data(), second.get_data())
+        self.assertEqual(['TEST-1'], renders)
+
+        self._request_get(
+            'test_render_cache', '/atlassian_connect/webpanel/cached?issueKey=TEST-2')
+        self._request_get('other_tenant', url)
+        self.assertEqual(['TEST-1', 'TEST-2', 'TEST-1'], renders)
+
+        client = _TestClient.load('test_render_cache')
+        response = self.client.get(url, headers={
+            'Authorization': 'JWT ' + encode_token(
+                'GET', url, client.clientKey, client.sharedSecret),
+            'If-None-Match': first.headers['ETag']})
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(b'', response.get_data())
+
+    def test_render_cache_headers(self):
+        """Handler headers are replayed, cookie setting renders are not cached"""
+        renders = []
+
+        def _panel(client, **kwargs):
+            renders.append(request.args.get('cookie'))
+            headers = {'X-Frame-Options': 'ALLOW-FROM https://example.com',
+                       'Content-Security-Policy': "frame-ancestors 'self'"}
+            if request.args.get('cookie'):
+                headers['Set-Cookie'] = 'session=1'
+            return 'panel', 200, headers
+        self.ac.webpanel(key="headers", cache_ttl=60)(_panel)
+
+        url = '/atlassian_connect/webpanel/headers'
+        for _ in range(2):
+            response = self._request_get('test_render_cache_headers', url)
+            self.assertEqual('ALLOW-FROM https://example.com',
+                             response.headers['X-Frame-Options'])
+            self.assertEqual("frame-ancestors 'self'",
+                             response.headers['Content-Security-Policy'])
+            self.assertEqual(1, len(response.headers.getlist('Cache-Control')))
+        self.assertEqual([None], renders)
+
+        for _ in range(2):
+            response = self._request_get(
+                'test_render_cache_headers', url + '?cookie=1')
+            self.assertEqual('session=1', response.headers['Set-Cookie'])
+        self.assertEqual([None, '1', '1'], renders)
+
+    def test_render_cache_user(self):
+        """Renders are cached per user (the JWT sub)"""
+        renders = []
+
+        def _panel(client, **kwargs):
+            renders.append(1)
+            return 'panel'
+        self.ac.webpanel(key="users", cache_ttl=60)(_panel)
+
+        url = '/atlassian_connect/webpanel/users'
+        self._request_get('test_render_cache_user', url)
+        client = _TestClient.load('test_render_cache_user')
+        for user in ('alice', 'bob', 'alice'):
+            token = jwt.encode({
+                'iss': client.clientKey, 'sub': user, 'iat': int(time.time()),
+                'exp': int(time.time()) + 60, 'qsh': hash_url('GET', url),
+            }, client.sharedSecret, algorithm='HS256').decode('ascii')
+            self.assertEqual(200, self.client.get(
+                url, headers={'Authorization': 'JWT ' + token}).status_code)
+        self.assertEqual(3, len(renders))
+
+    def test_render_cache_webhook(self):
+        """Webhook bodies are not part of the key, so they cannot be cached"""
+        with self.assertRaises(ValueError):
+            self.ac.webhook("jira:issue_created", cache_ttl=60)
+        with self.assertRaises(ValueError):
+            self.ac.register_modules([{"type": "webhook", "event": "jira:issue_updated",
+                                       "handler": decorator_noop, "cache_ttl": 60}])
+        self.assertNotIn('webhook', self.ac.sections)
+
+    def test_render_cache_key(self):
+        """Handlers choose what to cache on, None skips the cache"""
+        renders = []
+
+        def _module(client, **kwargs):
+            renders.append(1)
+            return 'hello'
+        self.ac.module(
+            key="cached", cache_ttl=60,
+            cache_key=lambda client, args: args.get('page'))(_module)
+        self.ac.module(key="noop", cache_ttl=60)(decorator_noop)
+
+        for url in ('/atlassian_connect/module/cached?page=1&x=1',
+                    '/atlassian_connect/module/cached?page=1&x=2',
+                    '/atlassian_connect/module/cached',
+                    '/atlassian_connect/module/cached'):
+            self.assertEqual(200, self._request_get('test_cache_key', url).status_code)
+        self.assertEqual(3, len(renders))
+
+        # Only successful renders are cached
+        response = self._request_get(
+            'test_cache_key', '/atlassian_connect/module/noop')
+        self.assertEqual(204, response.status_code)
+        self.assertNotIn('ETag', response.headers)
+
+    def test_register_modules(self):
+        """Bulk registration matches the decorators"""
+        self.ac.register_modules([
+            {"type": "webhook", "event": "jira:issue_created",
+             "filter": "project is 'IM'", "handler": decorator_noop},
+            {"type": "module", "key": "configurePage", "name": "Configure",
+             "handler": decorator_noop},
+            {"type": "webpanel", "key": "userPanel",
+             "location": "atl.jira.view.issue.right.context",
+             "handler": decorator_a_string},
+        ])
+
+        response = self.client.get('/atlassian_connect/descriptor')
+        modules = json.loads(response.get_data(as_text=True))["modules"]
+        self.assertEqual([{
+            "event": "jira:issue_created",
+            "excludeBody": False,
+            "filter": "project is 'IM'",
+            "url": "/atlassian_connect/webhook/jiraissue_created"
+        }], modules["webhooks"])
+        self.assertEqual({
+            "key": "configurePage",
+            "name": {"value": "Configure"},
+            "url": "/atlassian_connect/module/configurePage"
+        }, modules["configurePage"])
+        self.assertEqual("atl.jira.view.issue.right.context",
+                         modules["webPanels"][0]["location"])
+
+        response = self._request_get(
+            'test_register_modules',
+            '/atlassian_connect/webpanel/userPanel?issueKey=TEST-1')
+        self.assertEqual(200, response.status_code)
+        response = self._request_post(
+            'test_register_modules',
+            '/atlassian_connect/webhook/jiraissue_created',
+            {"key": "value"})
+        self.assertEqual(204, response.status_code)
+
+    def test_register_modules_invalid(self):
+        """Bad keys and types are rejected before anything is registered"""
+        with self.assertRaises(Exception):
+            self.ac.register_modules([
+                {"type": "webpanel", "key": "bad key", "handler": decorator_noop}])
+        with self.assertRaises(Exception):
+            self.ac.register_modules([
+                {"type": "module", "key": "bad/key", "handler": decorator_noop}])
+        with self.assertRaises(ValueError):
+            self.ac.register_modules([
+                {"type": "nope", "key": "key", "handler": decorator_noop}])
+        self.assertNotIn('webpanel', self.ac.sections)
+        self.assertNotIn('module', self.ac.sections)
+
     def test_decorator_return_values(self):
         """Confirm webpanel decorator works right"""
         self.ac.webpanel(key="aString")(decorator_a_string)
@@ -291,6 +793,73 @@ class ACFlaskTestCase(unittest.TestCase):
         self.assertEqual(204, response.status_code)
         self.assertEqual('', response.get_data(as_text=True))
 
+    def test_max_concurrency(self):
+        """Requests over a handler's limit are shed straight away"""
+        started, release = threading.Event(), threading.Event()
+
+        def slow(client, event):
+            started.set()
+            release.wait(5)
+        self.ac.webhook('jira:issue_created', max_concurrency=1)(slow)
+        self.ac.module('configurePage')(decorator_noop)
+
+        results = []
+        thread = threading.Thread(target=lambda: results.append(self._request_post(
+            'test_webook', '/atlassian_connect/webhook/jiraissue_created', {})))
+        thread.start()
+        self.assertTrue(started.wait(5))
+        try:
+            rv = self._request_post(
+                'test_webook', '/atlassian_connect/webhook/jiraissue_created', {})
+            self.assertEqual(503, rv.status_code)
+            self.assertEqual('1', rv.headers['Retry-After'])
+            # other handlers are not affected
+            rv = self._request_get('abc123', '/atlassian_connect/module/configurePage')
+            self.assertEqual(204, rv.status_code)
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(204, results[0].status_code)
+        self.assertEqual(204, self._request_post(
+            'test_webook', '/atlassian_connect/webhook/jiraissue_created', {}
+        ).status_code)
+
+    def test_section_concurrency(self):
+        """ADDON_SECTION_CONCURRENCY caps a whole section, never lifecycle"""
+        app = Flask("app")
+        app.config['ADDON_SECTION_CONCURRENCY'] = {'module': 1, 'lifecycle': 1}
+        ac = AtlassianConnect(app, client_class=_TestClient)
+        self.assertEqual(['module'], list(ac.section_limits))
+
+        started, release = threading.Event(), threading.Event()
+
+        def slow(client):
+            started.set()
+            release.wait(5)
+        ac.module('slowPage')(slow)
+        ac.module('fastPage')(decorator_noop)
+        ac.webpanel('userPanel')(decorator_noop)
+        client = app.test_client()
+        _TestClient.save(_TestClient(clientKey='abc123', sharedSecret='myscret'))
+
+        def _get(url):
+            auth = encode_token('GET', url, 'abc123', 'myscret')
+            return client.get(url, headers={'Authorization': 'JWT ' + auth})
+
+        results = []
+        thread = threading.Thread(target=lambda: results.append(
+            _get('/atlassian_connect/module/slowPage')))
+        thread.start()
+        self.assertTrue(started.wait(5))
+        try:
+            self.assertEqual(503, _get('/atlassian_connect/module/fastPage').status_code)
+            self.assertEqual(204, _get('/atlassian_connect/webpanel/userPanel').status_code)
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(204, results[0].status_code)
+        self.assertEqual(1, ac.section_limits['module'].shed)
+        self.assertEqual(0, ac.section_limits['module'].active)
 
 
 class NoAppACFlaskTestCase(ACFlaskTestCase):
@@ -0,0 +1,50 @@
+import unittest
+from atlassian_jwt.url_utils import canonicalize_request, hash_url
+from flask import Flask, g
+from .. import canonical
+from ..canonical import (canonical_request, query_string_hash, request_url)
+
+URLS = [
+    '/',
+    '/atlassian_connect/webpanel/userPanel?issueKey=TEST-1',
+    '/path?zee_last=param&repeated=parameter 1&first=param&repeated=parameter 2',
+    '/path?b=2&a=1&jwt=ignored',
+    '/path?jwt=ignored',
+    '/path?jwtx=1&jwt=ignored&xjwt=2',
+    'http://localhost/atlassian_connect/module/configurePage',
+]
+
+
+class CanonicalTestCase(unittest.TestCase):
+    """Test Case"""
+    def test_matches_atlassian_jwt(self):
+        for url in URLS:
+            self.assertEqual(canonicalize_request('get', url),
+                             canonical_request('get', url))
+            self.assertEqual(hash_url('POST', url), query_string_hash('POST', url))
+
+    def test_lru(self):
+        canonical._hashes.clear()
+        query_string_hash('GET', '/lru?a=1')
+        self.assertIn(('GET', '/lru?a=1'), canonical._hashes)
+        query_string_hash('get', '/lru?a=1')
+        self.assertEqual(1, len(canonical._hashes))
+        query_string_hash('GET', '/lru?a=1&jwt=token1')
+        query_string_hash('GET', '/lru?jwt=token2&a=1')
+        self.assertEqual(1, len(canonical._hashes))
+
+    def test_request_memo(self):
+        app = Flask("app")
+        with app.test_request_context('/some/path?b=2&a=1&jwt=abc'):
+            self.assertEqual('/some/path?b=2&a=1&jwt=abc', request_url())
+            qsh = query_string_hash('GET', request_url())
+            self.assertEqual(qsh, hash_url('GET', '/some/path?a=1&b=2'))
+            self.assertIn(('GET', '/some/path?b=2&a=1'), g._ac_canonical)
+        with app.test_request_context('/some/path'):
+            self.assertEqual('/some/path', request_url())
+        with app.test_request_context(environ_overrides={'QUERY_STRING': 'a=\xff'}):
+            self.assertEqual('/?a=\ufffd', request_url())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import requests_mock
+from atlassian_jwt.encode import encode_token
+from flask import Flask
+from .. import AtlassianConnect
+from .test_addon import _TestClient, consumer_info_response, decorator_noop
+
+try:
+    from ..encryption import SecretBox, generate_key
+except ImportError:
+    SecretBox = None
+
+
+@unittest.skipIf(SecretBox is None, "cryptography is not installed")
+class SecretBoxTestCase(unittest.TestCase):
+    """Test Case"""
+    def test_round_trip(self):
+        """Secrets come back out, and each one gets its own data key"""
+        box = SecretBox(generate_key())
+        first, second = box.encrypt('myscret'), box.encrypt('myscret')
+        self.assertTrue(SecretBox.is_encrypted(first))
+        self.assertNotIn('myscret', first)
+        self.assertNotEqual(first, second)
+        self.assertEqual('myscret', box.decrypt(first))
+        # ciphertext lookalikes are encrypted like any other secret
+        self.assertEqual(first, box.decrypt(box.encrypt(first)))
+        self.assertEqual('plain', box.decrypt('plain'))
+
+    def test_key_rotation(self):
+        """Secrets encrypted with a retired key still decrypt"""
+        old, new = generate_key(), generate_key()
+        value = SecretBox([old]).encrypt('myscret')
+        self.assertEqual('myscret', SecretBox([new, old]).decrypt(value))
+
+    def test_cached_decrypt(self):
+        """Only a changed ciphertext is decrypted again"""
+        box = SecretBox(generate_key())
+        first, second = box.encrypt('one'), box.encrypt('two')
+        self.assertEqual('one', box.secret_for('abc123', first))
+        box._master = None  # any further decrypt would fail
+        self.assertEqual('one', box.secret_for('abc123', first))
+        with self.assertRaises(AttributeError):
+            box.secret_for('abc123', second)
+
+
+@unittest.skipIf(SecretBox is None, "cryptography is not installed")
+class EncryptedACFlaskTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.app = Flask("app")
+        self.app.testing = True
+        self.app.config['ADDON_SECRET_KEYS'] = [generate_key()]
+        self.ac = AtlassianConnect(self.app, client_class=_TestClient)
+        _TestClient.reset()
+        self.client = self.app.test_client()
+        self.ac.lifecycle('installed')(decorator_noop)
+
+    @requests_mock.Mocker()
+    def test_secret_stored_encrypted(self, m):
+        """The store only sees ciphertext, requests still authenticate"""
+        m.get('https://gavindev.atlassian.net/plugins/servlet/oauth/consumer-info',
+              text=consumer_info_response)
+        self.ac.webpanel(key="userPanel")(decorator_noop)
+        client = dict(
+            baseUrl='https://gavindev.atlassian.net',
+            clientKey='abc123',
+            publicKey='public123',
+            sharedSecret='myscret')
+        rv = self.client.post('/atlassian_connect/lifecycle/installed',
+                              data=json.dumps(client),
+                              content_type='application/json')
+        self.assertEqual(204, rv.status_code)
+
+        stored = _TestClient.load('abc123')
+        self.assertTrue(SecretBox.is_encrypted(stored.sharedSecret))
+        self.assertEqual('myscret', self.ac.shared_secret(stored))
+
+        url = '/atlassian_connect/webpanel/userPanel'
+        auth = encode_token('GET', url, 'abc123', 'myscret')
+        rv = self.client.get(url, headers={'Authorization': 'JWT ' + auth})
+        self.assertEqual(204, rv.status_code)
+
+        # reinstalling with a new secret is signed with the old one
+        auth = encode_token('GET', '/lifecycle/installed', 'abc123', 'myscret')
+        client['sharedSecret'] = 'newscret'
+        rv = self.client.post('/atlassian_connect/lifecycle/installed',
+                              data=json.dumps(client),
+                              content_type='application/json',
+                              headers={'Authorization': 'JWT ' + auth})
+        self.assertEqual(204, rv.status_code)
+        self.assertEqual(
+            'newscret', self.ac.shared_secret(_TestClient.load('abc123')))
+
+    @requests_mock.Mocker()
+    def test_ciphertext_lookalike_secret(self, m):
+        """A secret that looks encrypted is still encrypted on install"""
+        m.get('https://gavindev.atlassian.net/plugins/servlet/oauth/consumer-info',
+              text=consumer_info_response)
+        secret = SecretBox(generate_key()).encrypt('chosen')
+        rv = self.client.post('/atlassian_connect/lifecycle/installed',
+                              data=json.dumps(dict(
+                                  baseUrl='https://gavindev.atlassian.net',
+                                  clientKey='abc123',
+                                  publicKey='public123',
+                                  sharedSecret=secret)),
+                              content_type='application/json')
+        self.assertEqual(204, rv.status_code)
+        stored = _TestClient.load('abc123')
+        self.assertNotEqual(secret, stored.sharedSecret)
+        self.assertEqual(secret, self.ac.shared_secret(stored))
+
+    @requests_mock.Mocker()
+    def test_journaled_install(self, m):
+        """Journaled installs are encrypted once, not again when applied"""
+        m.get('https://gavindev.atlassian.net/plugins/servlet/oauth/consumer-info',
+              text=consumer_info_response)
+        tmpdir = tempfile.mkdtemp()
+        self.app = Flask("app")
+        self.app.config['ADDON_SECRET_KEYS'] = [generate_key()]
+        self.app.config['ADDON_LIFECYCLE_JOURNAL'] = os.path.join(tmpdir, 'journal.db')
+        self.ac = AtlassianConnect(self.app, client_class=_TestClient)
+        self.client = self.app.test_client()
+        self.ac.lifecycle('installed')(decorator_noop)
+        try:
+            rv = self.client.post('/atlassian_connect/lifecycle/installed',
+                                  data=json.dumps(dict(
+                                      baseUrl='https://gavindev.atlassian.net',
+                                      clientKey='abc123',
+                                      publicKey='public123',
+                                      sharedSecret='myscret')),
+                                  content_type='application/json')
+            self.assertEqual(204, rv.status_code)
+            self.assertTrue(self.ac.journal.flush(5))
+            self.assertNotIn('myscret', json.dumps(self.ac.journal.entries()))
+            self.assertEqual(
+                'myscret', self.ac.shared_secret(_TestClient.load('abc123')))
+        finally:
+            self.ac.shutdown()
+            shutil.rmtree(tmpdir)
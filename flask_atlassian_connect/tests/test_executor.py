@@ -0,0 +1,146 @@
+import threading
+import time
+import unittest
+from flask import Flask
+from .. import AtlassianConnect
+from ..executor import TenantExecutor, TenantQueueFull
+from .test_addon import ACFlaskTestCase, _TestClient, decorator_noop
+
+
+class TenantExecutorTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.executor = TenantExecutor(workers=1, queue_limit=3)
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.order = []
+        self.threads = []
+
+    def tearDown(self):
+        self.release.set()
+        for thread in self.threads:
+            thread.join()
+        self.executor.shutdown()
+
+    def _submit(self, client_key, func, *args):
+        """Call run() on a new thread and wait until it is queued"""
+        queued = self.executor.pending(client_key) + 1
+        thread = threading.Thread(
+            target=self.executor.run, args=(client_key, func) + args)
+        thread.start()
+        self.threads.append(thread)
+        while self.executor.pending(client_key) < queued:
+            time.sleep(0.001)
+
+    def _block(self):
+        """Occupy the only slot until released"""
+        def _blocker():
+            self.started.set()
+            self.release.wait()
+        thread = threading.Thread(target=self.executor.run, args=('blocker', _blocker))
+        thread.start()
+        self.threads.append(thread)
+        self.started.wait()
+
+    def _finish(self):
+        self.release.set()
+        for thread in self.threads:
+            thread.join()
+
+    def _record(self, name):
+        self.order.append(name)
+        return name
+
+    def test_round_robin(self):
+        """A noisy tenant does not starve a quiet one"""
+        self._block()
+        for i in range(3):
+            self._submit('noisy', self._record, 'noisy%d' % i)
+        self._submit('quiet', self._record, 'quiet')
+        self._finish()
+        self.assertEqual(['noisy0', 'quiet', 'noisy1', 'noisy2'], self.order)
+
+    def test_weights(self):
+        """Weighted tenants get several jobs per turn"""
+        self.executor.weights = {'big': 2}
+        self._block()
+        for i in range(3):
+            self._submit('big', self._record, 'big%d' % i)
+        for i in range(2):
+            self._submit('small', self._record, 'small%d' % i)
+        self._finish()
+        self.assertEqual(['big0', 'big1', 'small0', 'big2', 'small1'], self.order)
+
+    def test_queue_limit(self):
+        """Work past the per tenant limit is shed, others are unaffected"""
+        self._block()
+        for _ in range(3):
+            self._submit('noisy', self._record, 'noisy')
+        with self.assertRaises(TenantQueueFull):
+            self.executor.run('noisy', self._record, 'noisy')
+        self._submit('quiet', self._record, 'quiet')
+        self.assertEqual(3, self.executor.pending('noisy'))
+        self._finish()
+        self.assertEqual(['noisy'] * 3 + ['quiet'], sorted(self.order))
+
+    def test_inline(self):
+        """Admitted work runs on the calling thread"""
+        self.assertIs(threading.current_thread(),
+                      self.executor.run('tenant', threading.current_thread))
+
+    def test_errors(self):
+        """Exceptions are raised back to the caller"""
+        def _fail():
+            raise ValueError('boom')
+        with self.assertRaises(ValueError):
+            self.executor.run('tenant', _fail)
+        self.assertEqual(4, self.executor.run('tenant', lambda: 4))
+
+
+class ExecutorACFlaskTestCase(ACFlaskTestCase):
+    """Run the whole addon test suite with the tenant executor enabled"""
+    def setUp(self):
+        self.app = Flask("app")
+        self.app.testing = True
+        self.app.config['ADDON_TENANT_WORKERS'] = 2
+        self.ac = AtlassianConnect(self.app, client_class=_TestClient)
+        _TestClient.reset()
+        self.client = self.app.test_client()
+        self.ac.lifecycle('installed')(decorator_noop)
+
+    def tearDown(self):
+        self.ac.shutdown()
+
+    def test_executor_configured(self):
+        self.assertIsInstance(self.ac.executor, TenantExecutor)
+        self.assertEqual(2, self.ac.executor.workers)
+
+    def test_shedding(self):
+        """A full tenant queue answers 503 with Retry-After"""
+        self.ac.module(key="configurePage")(decorator_noop)
+        self.ac.executor.queue_limit = 1
+        release = threading.Event()
+        threads = []
+        for i in range(3):
+            started = threading.Event()
+            threads.append(threading.Thread(target=self.ac.executor.run, args=(
+                'blocker%d' % i if i < 2 else 'test_shedding',
+                lambda s=started: s.set() or release.wait())))
+            threads[-1].start()
+            if i < 2:
+                started.wait()
+        while not self.ac.executor.pending('test_shedding'):
+            time.sleep(0.001)
+        try:
+            response = self._request_get(
+                'test_shedding', "/atlassian_connect/module/configurePage")
+        finally:
+            release.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(503, response.status_code)
+        self.assertEqual('1', response.headers['Retry-After'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import subprocess
+import sys
+import unittest
+
+# Heavy dependencies that should only be imported once they are needed
+LAZY_MODULES = ['requests', 'jwt', 'atlassian_jwt', 'invoke']
+
+# Budget (in microseconds) for the self time of our own modules, flask
+# itself is excluded as there is no way to avoid it
+IMPORT_BUDGET_US = 50000
+
+
+def _run(code, *args):
+    return subprocess.run(
+        [sys.executable] + list(args) + ['-c', code],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True)
+
+
+class ImportTimeTestCase(unittest.TestCase):
+    """Keep `import flask_atlassian_connect` cheap"""
+    def test_heavy_dependencies_are_lazy(self):
+        result = _run(
+            'import sys, flask_atlassian_connect; '
+            'print(",".join(m for m in %r if m in sys.modules))' % LAZY_MODULES)
+        self.assertEqual('', result.stdout.strip())
+
+    def test_import_time_budget(self):
+        result = _run('import flask_atlassian_connect', '-X', 'importtime')
+        self_time = 0
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or '|' not in line:
+                continue
+            us, _, name = line[len('import time:'):].split('|')
+            if name.strip().startswith('flask_atlassian_connect'):
+                self_time += int(us)
+        self.assertLess(self_time, IMPORT_BUDGET_US)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+import mock
+from atlassian_jwt.encode import encode_token
+from flask import Flask
+from .. import AtlassianConnect
+from ..index import TenantIndex, normalize_url
+from .test_addon import _TestClient, decorator_noop
+
+
+class TenantIndexTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.index = TenantIndex()
+        self.index.rebuild({
+            'jira': _TestClient(clientKey='jira', productType='jira',
+                                baseUrl='https://Example.atlassian.net/'),
+            'confluence': {'clientKey': 'confluence', 'productType': 'confluence',
+                           'baseUrl': 'https://example.atlassian.net/wiki'},
+            'old': _TestClient(clientKey='old', productType='jira', enabled=False,
+                               baseUrl='https://old.example.com:8443/jira'),
+        })
+
+    def test_normalize_url(self):
+        self.assertEqual('https://example.atlassian.net',
+                         normalize_url('HTTPS://Example.Atlassian.net:443/'))
+        self.assertEqual('http://host:8080/jira',
+                         normalize_url('http://host:8080/jira/?a=b#c'))
+
+    def test_lookup(self):
+        """Product urls map to the tenant with the longest matching baseUrl"""
+        self.assertEqual('jira', self.index.by_base_url('https://example.atlassian.net'))
+        self.assertEqual('jira', self.index.lookup(
+            'https://example.atlassian.net/browse/TEST-1?focusedCommentId=2'))
+        self.assertEqual('confluence', self.index.lookup(
+            'https://example.atlassian.net/wiki/spaces/DOC/overview'))
+        self.assertEqual('old', self.index.lookup(
+            'https://old.example.com:8443/jira/browse/TEST-1'))
+        self.assertIsNone(self.index.lookup('https://old.example.com/jira'))
+        self.assertIsNone(self.index.lookup('https://other.atlassian.net/wiki'))
+
+    def test_filters(self):
+        self.assertEqual(set(['jira', 'confluence', 'old']), self.index.client_keys())
+        self.assertEqual(set(['jira']), self.index.client_keys('jira', enabled=True))
+        self.assertEqual(set(['old']), self.index.client_keys(enabled=False))
+        self.assertEqual(set(), self.index.client_keys('bitbucket'))
+        self.assertFalse(self.index.is_enabled('old'))
+        self.assertIsNone(self.index.is_enabled('unknown'))
+
+    def test_update_and_remove(self):
+        """Changed baseUrls and removed tenants leave nothing behind"""
+        self.index.update(_TestClient(clientKey='jira', productType='jira',
+                                      baseUrl='https://renamed.atlassian.net'))
+        self.assertIsNone(self.index.by_base_url('https://example.atlassian.net'))
+        self.assertEqual('jira', self.index.lookup('https://renamed.atlassian.net/browse/X-1'))
+        self.index.remove('old')
+        self.index.remove('old')
+        self.assertNotIn('old', self.index)
+        self.assertEqual(set(['jira']), self.index.client_keys('jira'))
+        self.assertEqual(set(), self.index.client_keys(enabled=False))
+        self.assertEqual(2, len(self.index))
+
+    def test_rebuild(self):
+        """Rebuilding swaps in a new index, readers of the old one are unaffected"""
+        by_url = self.index._by_url
+        self.index.rebuild([{'clientKey': 'new', 'baseUrl': 'https://new.example.com'}])
+        self.assertEqual(set(['new']), self.index.client_keys())
+        self.assertEqual('new', self.index.lookup('https://new.example.com/x'))
+        self.assertEqual('jira', by_url['https://example.atlassian.net'])
+
+
+class IndexedACFlaskTestCase(unittest.TestCase):
+    """Test Case"""
+    def test_kept_up_to_date(self):
+        """Clients the addon loads, saves or deletes are indexed"""
+        app = Flask("app")
+        ac = AtlassianConnect(app, client_class=_TestClient)
+        ac.webpanel(key="userPanel")(decorator_noop)
+        _TestClient.reset()
+        _TestClient.save(_TestClient(clientKey='abc123', sharedSecret='myscret',
+                                     baseUrl='https://gavindev.atlassian.net'))
+        self.assertNotIn('abc123', ac.tenants)
+
+        url = '/atlassian_connect/webpanel/userPanel'
+        auth = encode_token('GET', url, 'abc123', 'myscret')
+        app.test_client().get(url, headers={'Authorization': 'JWT ' + auth})
+        self.assertEqual('abc123', ac.tenants.lookup(
+            'https://gavindev.atlassian.net/browse/TEST-1'))
+
+        ac._save_client(_TestClient(clientKey='other', sharedSecret='x',
+                                    baseUrl='https://other.atlassian.net'))
+        self.assertEqual('other', ac.tenants.by_base_url('https://other.atlassian.net'))
+        ac._delete_client('other')
+        self.assertIsNone(ac.tenants.by_base_url('https://other.atlassian.net'))
+
+    def test_failed_save(self):
+        """A client is only indexed once it was saved"""
+        app = Flask("app")
+        ac = AtlassianConnect(app, client_class=_TestClient)
+        _TestClient.reset()
+        client = _TestClient(clientKey='broken', baseUrl='https://broken.atlassian.net')
+        with mock.patch.object(_TestClient, 'save', side_effect=IOError('disk full')):
+            with self.assertRaises(IOError):
+                ac._save_client(client)
+        self.assertNotIn('broken', ac.tenants)
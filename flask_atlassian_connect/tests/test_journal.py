@@ -0,0 +1,238 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import requests_mock
+from atlassian_jwt.encode import encode_token
+from flask import Flask
+from .. import AtlassianConnect
+from ..journal import LifecycleJournal, _Append
+from .test_addon import _TestClient, consumer_info_response, decorator_noop
+
+
+class LifecycleJournalTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'journal.db')
+        self.applied = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _apply(self, event_type, payload):
+        self.applied.append((event_type, payload['clientKey']))
+
+    def test_append_and_apply(self):
+        journal = LifecycleJournal(self.path, apply=self._apply)
+        first = journal.append('installed', {'clientKey': 'a'})
+        second = journal.append('disabled', {'clientKey': 'a'})
+        self.assertLess(first, second)
+        self.assertTrue(journal.flush(5))
+        journal.close()
+        self.assertEqual([('installed', 'a'), ('disabled', 'a')], self.applied)
+
+        journal = LifecycleJournal(self.path)
+        entries = journal.entries()
+        journal.close()
+        self.assertEqual(['installed', 'disabled'], [e['eventType'] for e in entries])
+        self.assertTrue(all(e['applied'] for e in entries))
+        self.assertEqual({'clientKey': 'a'}, entries[0]['payload'])
+
+    def test_replay_after_restart(self):
+        """Events recorded but never applied are applied on the next open"""
+        journal = LifecycleJournal(self.path)
+        journal.append('installed', {'clientKey': 'a'})
+        journal.append('installed', {'clientKey': 'b'})
+        journal.close()
+
+        journal = LifecycleJournal(self.path, apply=self._apply)
+        self.assertTrue(journal.flush(5))
+        journal.append('installed', {'clientKey': 'c'})
+        self.assertTrue(journal.flush(5))
+        journal.close()
+        self.assertEqual(['a', 'b', 'c'], [key for _, key in self.applied])
+
+    def test_apply_errors_are_recorded(self):
+        """Events are given up on after max_attempts, later ones still apply"""
+        calls = []
+
+        def _fail(event_type, payload):
+            calls.append(payload['clientKey'])
+            if payload['clientKey'] == 'a':
+                raise ValueError('broken store')
+        journal = LifecycleJournal(self.path, apply=_fail, max_attempts=3,
+                                   retry_delay=0.001)
+        journal.append('installed', {'clientKey': 'a'})
+        journal.append('installed', {'clientKey': 'b'})
+        self.assertTrue(journal.flush(5))
+        journal.close()
+        self.assertEqual(['a', 'a', 'a', 'b'], calls)
+        entries = journal.entries()
+        self.assertIn('broken store', entries[0]['error'])
+        self.assertIsNone(entries[1]['error'])
+
+    def test_apply_retries(self):
+        """A failing event is retried and holds back the ones after it"""
+        failures = [ValueError('flaky store')]
+
+        def _flaky(event_type, payload):
+            if failures:
+                raise failures.pop()
+            self._apply(event_type, payload)
+        journal = LifecycleJournal(self.path, apply=_flaky, retry_delay=0.001)
+        journal.append('installed', {'clientKey': 'a'})
+        journal.append('disabled', {'clientKey': 'a'})
+        self.assertTrue(journal.flush(5))
+        journal.close()
+        self.assertEqual([('installed', 'a'), ('disabled', 'a')], self.applied)
+        self.assertTrue(all(e['applied'] and e['error'] is None
+                            for e in journal.entries()))
+
+    def test_lazy_start(self):
+        """No threads run until the journal is used"""
+        journal = LifecycleJournal(self.path, apply=self._apply)
+        self.assertEqual([], journal._threads)
+        journal.append('installed', {'clientKey': 'a'})
+        self.assertEqual(2, len(journal._threads))
+        journal.close()
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "needs fork")
+    def test_fork(self):
+        """A journal created before forking works in the child"""
+        journal = LifecycleJournal(self.path, apply=self._apply)
+        journal.append('installed', {'clientKey': 'parent'})
+        self.assertTrue(journal.flush(5))
+        journal.close()
+        journal._closed = False
+
+        pid = os.fork()
+        if not pid:  # pragma: no cover
+            try:
+                journal.append('installed', {'clientKey': 'child'})
+                ok = journal.flush(5)
+                journal.close()
+            finally:
+                os._exit(0 if ok else 1)
+        self.assertEqual(0, os.waitpid(pid, 0)[1])
+        self.assertEqual(['parent'], [key for _, key in self.applied])
+        self.assertTrue(all(e['applied'] for e in journal.entries()))
+
+    def test_one_applier(self):
+        """Journals sharing a file apply every event once, in order"""
+        journals = [LifecycleJournal(self.path, apply=self._apply,
+                                     poll_interval=0.01) for _ in range(2)]
+        for i in range(10):
+            journals[i % 2].append('installed', {'clientKey': str(i)})
+        for journal in journals:
+            self.assertTrue(journal.flush(5))
+        for journal in journals:
+            journal.close()
+        self.assertEqual([str(i) for i in range(10)],
+                         [key for _, key in self.applied])
+
+    def test_group_commit(self):
+        """Appends waiting together are committed in one transaction"""
+        journal = LifecycleJournal(self.path)
+        journal._start()
+        entries = [_Append('installed', {'clientKey': str(i)}) for i in range(10)]
+        with journal._cond:
+            journal._pending.extend(entries)
+            journal._cond.notify_all()
+        for entry in entries:
+            entry.done.wait(5)
+        self.assertEqual(1, journal.commits)
+        self.assertEqual(10, len(set(entry.id for entry in entries)))
+
+        threads = [threading.Thread(target=journal.append,
+                                    args=('installed', {'clientKey': str(i)}))
+                   for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        journal.close()
+        self.assertEqual(30, len(journal.entries()))
+        self.assertLessEqual(journal.commits, 21)
+
+
+class JournalACFlaskTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.app = Flask("app")
+        self.app.testing = True
+        self.app.config['ADDON_LIFECYCLE_JOURNAL'] = os.path.join(
+            self.tmpdir, 'journal.db')
+        self.ac = AtlassianConnect(self.app, client_class=_TestClient)
+        _TestClient.reset()
+        self.client = self.app.test_client()
+        self.ac.lifecycle('installed')(decorator_noop)
+        self.ac.lifecycle('disabled')(decorator_noop)
+
+    def tearDown(self):
+        self.ac.shutdown()
+        shutil.rmtree(self.tmpdir)
+
+    def _post(self, name, data, secret=None):
+        url = '/atlassian_connect/lifecycle/' + name
+        headers = {}
+        if secret:
+            headers['Authorization'] = 'JWT ' + encode_token(
+                'POST', url, data['clientKey'], secret)
+        return self.client.post(url, data=json.dumps(data), headers=headers,
+                                content_type='application/json')
+
+    @requests_mock.Mocker()
+    def test_lifecycle(self, m):
+        m.get('https://gavindev.atlassian.net/plugins/servlet/oauth/consumer-info',
+              text=consumer_info_response)
+        client = dict(
+            baseUrl='https://gavindev.atlassian.net',
+            clientKey='abc123',
+            publicKey='public123',
+            sharedSecret='myscret')
+        rv = self._post('installed', client)
+        self.assertEqual(204, rv.status_code)
+        self.assertTrue(self.ac.journal.flush(5))
+        self.assertEqual('myscret', _TestClient.load('abc123').sharedSecret)
+
+        rv = self._post('disabled', {'clientKey': 'abc123'}, 'myscret')
+        self.assertEqual(204, rv.status_code)
+        self.assertTrue(self.ac.journal.flush(5))
+        self.assertFalse(_TestClient.load('abc123').enabled)
+
+        self.assertEqual(
+            ['installed', 'disabled'],
+            [e['eventType'] for e in self.ac.journal.entries()])
+
+    def test_unsigned_lifecycle(self):
+        """Unsigned or foreign lifecycle callbacks do not touch the store"""
+        _TestClient.save(_TestClient(
+            baseUrl='https://gavindev.atlassian.net', clientKey='abc123',
+            publicKey='public123', sharedSecret='myscret'))
+        _TestClient.save(_TestClient(
+            baseUrl='https://other.atlassian.net', clientKey='other',
+            publicKey='public123', sharedSecret='othersecret'))
+
+        self.assertEqual(401, self._post('disabled', {'clientKey': 'abc123'}).status_code)
+        self.assertEqual(401, self._post(
+            'disabled', {'clientKey': 'abc123'}, 'wrongsecret').status_code)
+        url = '/atlassian_connect/lifecycle/disabled'
+        rv = self.client.post(url, data=json.dumps({'clientKey': 'abc123'}),
+                              content_type='application/json', headers={
+                                  'Authorization': 'JWT ' + encode_token(
+                                      'POST', url, 'other', 'othersecret')})
+        self.assertEqual(401, rv.status_code)
+
+        self.assertEqual(401, self._post(
+            'disabled', {'clientKey': 'unknown'}, 'myscret').status_code)
+
+        self.assertIsNot(False, getattr(_TestClient.load('abc123'), 'enabled', None))
+        self.assertEqual([], self.ac.journal.entries())
+
+
+if __name__ == '__main__':
+    unittest.main()
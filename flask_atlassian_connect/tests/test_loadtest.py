@@ -0,0 +1,48 @@
+import unittest
+from flask import Flask
+from .. import AtlassianConnect
+from ..loadtest import LoadTest
+from .test_addon import _TestClient, decorator_noop, decorator_a_string
+
+
+class LoadTestTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.app = Flask("app")
+        self.app.testing = True
+        self.ac = AtlassianConnect(self.app, client_class=_TestClient)
+        _TestClient.reset()
+        self.ac.lifecycle('installed')(decorator_noop)
+        self.ac.webhook('jira:issue_created')(decorator_noop)
+        self.ac.module(key="configurePage")(decorator_noop)
+        self.ac.webpanel(key="userPanel")(decorator_a_string)
+
+    def test_installs_tenants(self):
+        """Tenants go through the installed lifecycle"""
+        clients = LoadTest(self.app, self.ac, tenants=3, seed=1).install()
+        self.assertEqual(3, len(clients))
+        for client in clients:
+            stored = _TestClient.load(client['clientKey'])
+            self.assertEqual(client['sharedSecret'], stored.sharedSecret)
+
+    def test_run(self):
+        """All the mixed traffic is signed and accepted"""
+        report = LoadTest(self.app, self.ac, tenants=3, concurrency=3,
+                          seed=1).run(60)
+        self.assertEqual(60, report.requests)
+        self.assertEqual(0, report.errors, report.statuses)
+        self.assertEqual(
+            set(['webhook', 'module', 'webpanel']), set(report.latencies))
+        self.assertGreater(report.throughput, 0)
+        self.assertEqual(60, report.as_dict()['latency']['all']['count'])
+        self.assertIn('webpanel', str(report))
+
+    def test_mix(self):
+        """Sections with no weight get no traffic"""
+        report = LoadTest(self.app, self.ac, tenants=1,
+                          mix={'webhook': 1}).run(5)
+        self.assertEqual(['webhook'], list(report.latencies))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import json
+import os
+import threading
+import unittest
+from concurrent.futures.process import BrokenProcessPool
+import mock
+from atlassian_jwt.encode import encode_token
+from flask import Flask
+from .. import AtlassianConnect
+from .test_addon import _TestClient, decorator_noop
+
+URL = '/atlassian_connect/webhook/jiraissue_created'
+
+
+def issue_created(client, event):
+    """Runs in a worker process"""
+    return json.dumps({
+        "pid": os.getpid(),
+        "clientKey": client.clientKey,
+        "secret": client.sharedSecret,
+        "issue": event["issue"]["key"],
+    })
+
+
+def issue_updated(client, event):
+    raise ValueError("bad changelog in %s" % event["issue"]["key"])
+
+
+def issue_deleted(client, event):
+    os._exit(1)
+
+
+class ProcessPoolACFlaskTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.app = Flask("app")
+        self.app.testing = True
+        self.app.config['ADDON_PROCESS_WORKERS'] = 1
+        self.ac = AtlassianConnect(self.app, client_class=_TestClient)
+        self.ac.webhook('jira:issue_created', process_pool=True)(issue_created)
+        self.ac.webhook('jira:issue_updated', process_pool=True)(issue_updated)
+        self.ac.webhook('jira:issue_deleted', process_pool=True)(issue_deleted)
+        _TestClient.reset()
+        _TestClient.save(_TestClient(clientKey='abc123', sharedSecret='myscret'))
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.ac.shutdown()
+
+    def _post(self, url):
+        auth = encode_token('POST', url, 'abc123', 'myscret')
+        return self.client.post(
+            url, data=json.dumps({"issue": {"key": "TEST-1"}}),
+            content_type='application/json',
+            headers={'Authorization': 'JWT ' + auth})
+
+    def test_runs_in_worker(self):
+        """The handler gets the client and event in another process"""
+        rv = self._post(URL)
+        self.assertEqual(200, rv.status_code)
+        result = json.loads(rv.get_data(as_text=True))
+        self.assertNotEqual(os.getpid(), result.pop("pid"))
+        self.assertEqual(
+            {"clientKey": "abc123", "secret": "myscret", "issue": "TEST-1"}, result)
+
+    def test_errors_are_reported(self):
+        """Exceptions in the worker are raised in the request"""
+        with self.assertRaises(ValueError) as raised:
+            self._post('/atlassian_connect/webhook/jiraissue_updated')
+        self.assertIn('TEST-1', str(raised.exception))
+        self.assertEqual(200, self._post(URL).status_code)
+
+    def test_broken_pool(self):
+        """A pool whose worker died is shut down and replaced"""
+        pool = self.ac.process_pool
+        with mock.patch.object(pool, 'shutdown', wraps=pool.shutdown) as shutdown:
+            with self.assertRaises(BrokenProcessPool):
+                self._post('/atlassian_connect/webhook/jiraissue_deleted')
+        shutdown.assert_called_once_with(wait=False)
+        self.assertEqual(200, self._post(URL).status_code)
+        self.assertIsNot(pool, self.ac.process_pool)
+
+    def test_one_pool(self):
+        """Concurrent first use starts a single pool"""
+        pools = []
+        threads = [threading.Thread(target=lambda: pools.append(self.ac.process_pool))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, len(set(map(id, pools))))
+
+    def test_only_webhooks(self):
+        """Modules and webpanels render in the request process"""
+        with self.assertRaises(ValueError):
+            self.ac.module(key="configurePage", process_pool=True)(decorator_noop)
+        with self.assertRaises(ValueError):
+            self.ac.webpanel(key="userPanel", process_pool=True)(decorator_noop)
+        with self.assertRaises(ValueError):
+            self.ac.register_modules([{'type': 'module', 'key': 'configurePage',
+                                       'handler': decorator_noop, 'process_pool': True}])
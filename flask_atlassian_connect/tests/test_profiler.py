@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from atlassian_jwt.encode import encode_token
+from flask import Flask
+from .. import AtlassianConnect
+from ..profiler import SamplingProfiler
+from .test_addon import _TestClient, decorator_noop
+
+
+def slow_panel(client):
+    """Busy enough to be sampled"""
+    time.sleep(0.05)
+
+
+class SamplingProfilerTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.profiler = SamplingProfiler(
+            self.directory, threshold=0.02, interval=0.001, keep=2)
+
+    def tearDown(self):
+        self.profiler.stop()
+        shutil.rmtree(self.directory)
+
+    def test_fast_requests_are_dropped(self):
+        """Nothing is written below the threshold"""
+        recording = self.profiler.begin()
+        self.assertIsNone(self.profiler.end(recording, 'webhook', 'fast'))
+        self.assertEqual([], os.listdir(self.directory))
+
+    def test_retention(self):
+        """Only the newest profiles are kept"""
+        paths = []
+        for _ in range(3):
+            recording = self.profiler.begin()
+            time.sleep(0.03)
+            paths.append(self.profiler.end(recording, 'webhook', 'slow', 'abc123'))
+        self.assertEqual(
+            sorted(os.path.basename(p) for p in paths[1:]),
+            sorted(os.listdir(self.directory)))
+        with open(paths[-1]) as profile:
+            line = profile.readline()
+        self.assertTrue(line.startswith('webhook/slow [abc123];'))
+        self.assertIn('test_retention (test_profiler.py:', line)
+
+
+class ProfiledACFlaskTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.app = Flask("app")
+        self.app.config['ADDON_PROFILE_DIR'] = self.directory
+        self.app.config['ADDON_PROFILE_THRESHOLD'] = 0.02
+        self.app.config['ADDON_PROFILE_INTERVAL'] = 0.001
+        _TestClient.reset()
+        _TestClient.save(_TestClient(clientKey='abc123', sharedSecret='myscret'))
+
+    def tearDown(self):
+        self.ac.shutdown()
+        shutil.rmtree(self.directory)
+
+    def _profile(self):
+        self.ac = AtlassianConnect(self.app, client_class=_TestClient)
+        self.ac.webpanel(key="slowPanel")(slow_panel)
+        self.ac.webpanel(key="fastPanel")(decorator_noop)
+        client = self.app.test_client()
+        for key in ('slowPanel', 'fastPanel'):
+            url = '/atlassian_connect/webpanel/' + key
+            auth = encode_token('GET', url, 'abc123', 'myscret')
+            rv = client.get(url, headers={'Authorization': 'JWT ' + auth})
+            self.assertEqual(204, rv.status_code)
+        profiles = os.listdir(self.directory)
+        self.assertEqual(1, len(profiles))
+        self.assertIn('-webpanel-slowPanel-abc123-', profiles[0])
+        with open(os.path.join(self.directory, profiles[0])) as profile:
+            return profile.read()
+
+    def test_slow_request(self):
+        """Slow requests are saved, tagged with where they came from"""
+        self.assertIn('slow_panel (test_profiler.py:', self._profile())
+
+    def test_slow_request_on_executor(self):
+        """Handlers run on the tenant executor are sampled too"""
+        self.app.config['ADDON_TENANT_WORKERS'] = 1
+        self.assertIn('slow_panel (test_profiler.py:', self._profile())
@@ -0,0 +1,160 @@
+import threading
+import unittest
+from fnmatch import fnmatch
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+from flask import Flask
+from atlassian_jwt.encode import encode_token
+from .. import AtlassianConnect
+from ..redis_client import RedisClient, RedisError
+from .test_addon import decorator_noop
+
+
+class _FakeRedisHandler(StreamRequestHandler):
+    """Just enough of the Redis protocol for RedisClient"""
+    def handle(self):
+        self.server.connections += 1
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2])
+            self.server.commands.append(args)
+            self.wfile.write(self._reply(
+                getattr(self, 'cmd_' + args[0].decode().lower(), self.unknown)(*args[1:])))
+
+    def _reply(self, value):
+        if value is None:
+            return b'$-1\r\n'
+        if isinstance(value, RedisError):
+            return b'-' + str(value).encode() + b'\r\n'
+        if isinstance(value, int):
+            return b':%d\r\n' % value
+        if isinstance(value, str):
+            return b'+' + value.encode() + b'\r\n'
+        if isinstance(value, list):
+            return b'*%d\r\n' % len(value) + b''.join(self._reply(v) for v in value)
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+
+    def unknown(self, *args):
+        return RedisError('ERR unknown command')
+
+    def cmd_auth(self, *args):
+        if args != self.server.credentials:
+            return RedisError('WRONGPASS invalid username-password pair')
+        return 'OK'
+
+    def cmd_select(self, db):
+        if int(db) > 15:
+            return RedisError('ERR DB index is out of range')
+        return 'OK'
+
+    def cmd_get(self, key):
+        return self.server.data.get(key)
+
+    def cmd_mget(self, *keys):
+        return [self.server.data.get(key) for key in keys]
+
+    def cmd_set(self, key, value):
+        self.server.data[key] = value
+        return 'OK'
+
+    def cmd_del(self, key):
+        return int(self.server.data.pop(key, None) is not None)
+
+    def cmd_scan(self, cursor, *options):
+        options = dict(zip(options[::2], options[1::2]))
+        keys = sorted(self.server.data)
+        start, end = int(cursor), int(cursor) + int(options.get(b'COUNT', 10))
+        batch = [k for k in keys[start:end]
+                 if fnmatch(k.decode(), options.get(b'MATCH', b'*').decode())]
+        return [str(end if end < len(keys) else 0).encode(), batch]
+
+
+class RedisClientTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.server = ThreadingTCPServer(('127.0.0.1', 0), _FakeRedisHandler)
+        self.server.daemon_threads = True
+        self.server.data = {}
+        self.server.commands = []
+        self.server.connections = 0
+        self.server.credentials = None
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.pool = RedisClient.connect(self._url())
+
+    def _url(self, auth='', db=0):
+        return 'redis://%s127.0.0.1:%d/%d' % (auth, self.server.server_address[1], db)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _client(self, n):
+        return RedisClient(clientKey='client%03d' % n, sharedSecret='secret',
+                           baseUrl='https://t%d.atlassian.net' % n)
+
+    def test_round_trip(self):
+        """Clients survive save/load/delete and connections are reused"""
+        RedisClient.save(self._client(1))
+        client = RedisClient.load('client001')
+        self.assertIsInstance(client, RedisClient)
+        self.assertEqual('https://t1.atlassian.net', client.baseUrl)
+        self.assertEqual('client001', dict(client)['clientKey'])
+        RedisClient.delete('client001')
+        self.assertIsNone(RedisClient.load('client001'))
+        self.assertEqual(1, self.server.connections)
+
+    def test_batches(self):
+        """save_many/load_many are pipelined, all() is streamed with SCAN"""
+        RedisClient.save_many([self._client(n) for n in range(25)])
+        self.server.data[b'other:key'] = b'not a client'
+        clients = RedisClient.load_many(['client003', 'missing', 'client010'])
+        self.assertEqual('client003', clients[0].clientKey)
+        self.assertIsNone(clients[1])
+        self.assertEqual('client010', clients[2].clientKey)
+
+        del self.server.commands[:]
+        RedisClient.scan_count = 10
+        try:
+            keys = [c.clientKey for c in RedisClient.all()]
+        finally:
+            RedisClient.scan_count = 500
+        self.assertEqual(['client%03d' % n for n in range(25)], keys)
+        self.assertEqual(3, len([c for c in self.server.commands if c[0] == b'SCAN']))
+
+    def test_error_reply(self):
+        """Error replies are raised and do not poison the connection"""
+        with self.assertRaises(RedisError):
+            self.pool.execute('NOPE')
+        self.assertIsNone(RedisClient.load('client001'))
+
+    def test_connection_setup(self):
+        """AUTH (with a username if given) and SELECT failures are raised"""
+        self.server.credentials = (b'user', b'p@ss')
+        for auth, db in ((':p%40ss@', 0), ('other:p%40ss@', 0),
+                         ('user:p%40ss@', 99)):
+            pool = RedisClient.connect(self._url(auth, db))
+            with self.assertRaises(RedisError):
+                pool.execute('GET', 'x')
+            pool.close()
+        pool = RedisClient.connect(self._url('user:p%40ss@', 2))
+        self.assertIsNone(pool.execute('GET', 'x'))
+        pool.close()
+        self.assertIn([b'AUTH', b'user', b'p@ss'], self.server.commands)
+        self.assertIn([b'SELECT', b'2'], self.server.commands)
+
+    def test_with_addon(self):
+        """Works as an AtlassianConnect client_class"""
+        app = Flask("app")
+        ac = AtlassianConnect(app, client_class=RedisClient)
+        ac.webpanel(key="userPanel")(decorator_noop)
+        RedisClient.save(RedisClient(clientKey='abc123', sharedSecret='myscret'))
+
+        url = '/atlassian_connect/webpanel/userPanel'
+        auth = encode_token('GET', url, 'abc123', 'myscret')
+        rv = app.test_client().get(url, headers={'Authorization': 'JWT ' + auth})
+        self.assertEqual(204, rv.status_code)
@@ -0,0 +1,141 @@
+import threading
+import unittest
+import mock
+from collections import Counter
+from flask import Flask, g
+from .. import AtlassianConnect
+from ..scheduler import Scheduler
+from .test_addon import _TestClient
+
+
+class SchedulerTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.app = Flask("app")
+        self.ac = AtlassianConnect(self.app, client_class=_TestClient)
+        _TestClient.reset()
+        self.runs = []
+
+    def tearDown(self):
+        self.ac.shutdown()
+
+    def _tenants(self, count, **kwargs):
+        for n in range(count):
+            _TestClient.save(_TestClient(
+                clientKey='client%03d' % n, sharedSecret='secret',
+                baseUrl='https://t%d.atlassian.net' % n, **kwargs))
+
+    def _scheduler(self, **kwargs):
+        kwargs.setdefault('jitter', 0)
+        return Scheduler(self.ac, self.app, timer=lambda: 0, **kwargs)
+
+    def _record(self, client):
+        self.runs.append((client.clientKey, g.ac_context.base_url))
+
+    @staticmethod
+    def _wait(futures):
+        for future in futures:
+            future.result(5)
+        return len(futures)
+
+    def test_spread_over_interval(self):
+        """Every tenant runs once per interval, not all at the same time"""
+        self._tenants(200)
+        self.ac.periodic(interval=100)(self._record)
+        scheduler = self._scheduler(refresh=1000)
+        started = Counter()
+        for now in range(200):
+            started[now // 10] += self._wait(scheduler.run_pending(now))
+        self.assertEqual(400, len(self.runs))
+        self.assertEqual(2, max(Counter(key for key, _ in self.runs).values()))
+        self.assertEqual(('client000', 'https://t0.atlassian.net'),
+                         sorted(self.runs)[0])
+        self.assertLess(max(started.values()), 40)
+
+    def test_jitter(self):
+        """Runs are delayed by at most jitter * interval"""
+        self._tenants(1)
+        self.ac.periodic(interval=100, name='sync')(self._record)
+        scheduler = self._scheduler(jitter=0.5)
+        first = next(t for t in range(200) if self._wait(scheduler.run_pending(t)))
+        scheduler = self._scheduler(jitter=0)
+        unjittered = next(t for t in range(200) if self._wait(scheduler.run_pending(t)))
+        self.assertTrue(unjittered <= first <= unjittered + 50)
+
+    def test_disabled_and_uninstalled(self):
+        """Disabled tenants are skipped, uninstalled ones dropped on refresh"""
+        self._tenants(2)
+        _TestClient.save(_TestClient(clientKey='disabled', enabled=False))
+        self.ac.periodic(interval=10)(self._record)
+        scheduler = self._scheduler(refresh=10)
+        for now in range(10):
+            self._wait(scheduler.run_pending(now))
+        self.assertEqual(['client000', 'client001'], sorted(k for k, _ in self.runs))
+
+        _TestClient.delete('client000')
+        del self.runs[:]
+        for now in range(10, 20):
+            self._wait(scheduler.run_pending(now))
+        self.assertEqual(['client001'], [k for k, _ in self.runs])
+
+    def test_rescan(self):
+        """The store is scanned at start and every rescan, not every refresh"""
+        self._tenants(1)
+        self.ac.periodic(interval=10)(self._record)
+        scheduler = self._scheduler(refresh=10, rescan=100)
+        with mock.patch.object(_TestClient, 'all', wraps=_TestClient.all) as scan:
+            self._wait(scheduler.run_pending(0))
+            # installed through this process, so ac.tenants already knows
+            self.ac._save_client(_TestClient(clientKey='client001', sharedSecret='secret'))
+            for now in range(1, 100):
+                self._wait(scheduler.run_pending(now))
+            self.assertEqual(1, scan.call_count)
+            self._wait(scheduler.run_pending(100))
+            self.assertEqual(2, scan.call_count)
+        self.assertIn('client001', [k for k, _ in self.runs])
+
+    def test_store_guard(self):
+        """Scans go through the store guard when there is one"""
+        app = Flask("guarded")
+        app.config['ADDON_STORE_TIMEOUT'] = 1
+        ac = AtlassianConnect(app, client_class=_TestClient)
+        self._tenants(1)
+        ac.periodic(interval=10)(self._record)
+        try:
+            with mock.patch.object(ac.store, 'all', wraps=ac.store.all) as scan:
+                scheduler = Scheduler(ac, app, jitter=0, timer=lambda: 0)
+                for now in range(10):
+                    self._wait(scheduler.run_pending(now))
+            self.assertEqual(1, scan.call_count)
+            self.assertEqual(['client000'], [k for k, _ in self.runs])
+        finally:
+            ac.shutdown()
+
+    def test_tenant_limit(self):
+        """A tenant's jobs wait for each other instead of piling up"""
+        self._tenants(1)
+        release = threading.Event()
+
+        def slow(client):
+            release.wait(5)
+            self.runs.append((client.clientKey, None))
+        self.ac.periodic(interval=1, name='first')(slow)
+        self.ac.periodic(interval=1, name='second')(slow)
+        scheduler = self._scheduler(tenant_limit=1)
+
+        scheduler.run_pending(0)
+        first = scheduler.run_pending(5)
+        self.assertEqual(1, len(first))
+        release.set()
+        self._wait(first)
+        # the deferred job waits a tick instead of being retried straight away
+        self.assertEqual(0, self._wait(scheduler.run_pending(5)))
+        self.assertEqual(1, self._wait(scheduler.run_pending(6)))
+        self.assertEqual(2, len(self.runs))
+
+    def test_start_scheduler(self):
+        """Started once, stopped by shutdown"""
+        scheduler = self.ac.start_scheduler()
+        self.assertIs(scheduler, self.ac.start_scheduler())
+        self.ac.shutdown()
+        self.assertIsNone(self.ac.scheduler)
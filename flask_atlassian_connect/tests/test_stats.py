@@ -0,0 +1,15 @@
+import unittest
+from ..stats import percentile
+
+
+class StatsTestCase(unittest.TestCase):
+    """Test Case"""
+    def test_percentile(self):
+        samples = list(range(101))
+        self.assertEqual(50, percentile(samples, 50))
+        self.assertEqual(99, percentile(samples, 99))
+        self.assertEqual(0.0, percentile([], 99))
+
+
+if __name__ == '__main__':
+    unittest.main()
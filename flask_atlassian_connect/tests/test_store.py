@@ -0,0 +1,154 @@
+import json
+import threading
+import unittest
+from atlassian_jwt.encode import encode_token
+from flask import Flask
+from .. import AtlassianConnect
+from ..store import CircuitBreaker, StoreGuard, StoreUnavailable
+from .test_addon import _TestClient, decorator_noop
+
+
+class _FlakyClient(_TestClient):
+    """Client store that can be made to fail or hang"""
+    broken = False
+    hang = None
+
+    @staticmethod
+    def load(clientKey):
+        if _FlakyClient.hang is not None:
+            _FlakyClient.hang.wait()
+        if _FlakyClient.broken:
+            raise IOError('store is down')
+        return _TestClient.load(clientKey)
+
+
+class CircuitBreakerTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.now = 0
+        self.breaker = CircuitBreaker(
+            failure_threshold=2, reset_timeout=10, timer=lambda: self.now)
+
+    def test_opens_and_recovers(self):
+        """Opens after the threshold, lets one trial through after the timeout"""
+        self.breaker.failure()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.failure()
+        self.assertEqual('open', self.breaker.state)
+        self.assertFalse(self.breaker.allow())
+
+        self.now = 10
+        self.assertEqual('half-open', self.breaker.state)
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        self.breaker.success()
+        self.assertEqual('closed', self.breaker.state)
+
+    def test_failed_trial_reopens(self):
+        """A failing trial call opens the breaker again straight away"""
+        self.breaker.failure()
+        self.breaker.failure()
+        self.now = 10
+        self.assertTrue(self.breaker.allow())
+        self.breaker.failure()
+        self.assertEqual('open', self.breaker.state)
+
+
+class StoreGuardTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        _TestClient.reset()
+        _FlakyClient.broken = False
+        _FlakyClient.hang = None
+        self.guard = StoreGuard(_FlakyClient, timeout=0.2, failure_threshold=2)
+        self.client = _TestClient(clientKey='abc123', sharedSecret='myscret')
+
+    def tearDown(self):
+        if _FlakyClient.hang is not None:
+            _FlakyClient.hang.set()
+        self.guard.shutdown()
+
+    def test_snapshot_fallback(self):
+        """Known clients are served from the snapshot while the store fails"""
+        self.guard.save('abc123', self.client)
+        _FlakyClient.broken = True
+        self.assertEqual('abc123', self.guard.load('abc123').clientKey)
+        with self.assertRaises(StoreUnavailable):
+            self.guard.load('unknown')
+        self.assertEqual('open', self.guard.breaker.state)
+        self.assertEqual('abc123', self.guard.load('abc123').clientKey)
+        self.assertEqual(2, self.guard.fallbacks)
+
+    def test_timeout(self):
+        """A hanging store counts as a failure"""
+        _FlakyClient.hang = threading.Event()
+        with self.assertRaises(StoreUnavailable):
+            self.guard.load('abc123')
+        self.assertEqual(1, self.guard.breaker.failures)
+        self.assertEqual(1, self.guard.latency()['count'])
+
+    def test_delete_forgets(self):
+        """Deleted clients are not served from the snapshot"""
+        self.guard.save('abc123', self.client)
+        self.guard.delete('abc123')
+        _FlakyClient.broken = True
+        with self.assertRaises(StoreUnavailable):
+            self.guard.load('abc123')
+
+
+class GuardedACFlaskTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        _TestClient.reset()
+        _FlakyClient.broken = False
+        _FlakyClient.hang = None
+        self.app = Flask("app")
+        self.app.testing = True
+        self.app.config['ADDON_STORE_TIMEOUT'] = 0.5
+        self.app.config['ADDON_STORE_FAILURE_THRESHOLD'] = 1
+        self.app.config['ADDON_HEALTH_ENDPOINT'] = True
+        self.ac = AtlassianConnect(self.app, client_class=_FlakyClient)
+        self.ac.webpanel(key="userPanel")(decorator_noop)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.ac.shutdown()
+
+    def _get(self, client_key):
+        url = '/atlassian_connect/webpanel/userPanel'
+        auth = encode_token('GET', url, client_key, 'myscret')
+        return self.client.get(url, headers={'Authorization': 'JWT ' + auth})
+
+    def test_degraded(self):
+        """Seen tenants keep working while the store is down, others get a 503"""
+        _TestClient.save(_TestClient(clientKey='abc123', sharedSecret='myscret'))
+        self.assertEqual(204, self._get('abc123').status_code)
+
+        _FlakyClient.broken = True
+        self.assertEqual(204, self._get('abc123').status_code)
+        rv = self._get('unknown')
+        self.assertEqual(503, rv.status_code)
+        self.assertIn('Retry-After', rv.headers)
+
+        health = json.loads(self.client.get('/atlassian_connect/health').get_data())
+        self.assertEqual('degraded', health['status'])
+        self.assertEqual('open', health['store']['state'])
+        self.assertEqual(1, health['store']['snapshot'])
+        self.assertEqual(set(['count', 'p50', 'p95', 'p99']),
+                         set(health['store']['latency']))
+
+    def test_health_without_guard(self):
+        """The endpoint works without a store guard"""
+        app = Flask("app")
+        app.config['ADDON_HEALTH_ENDPOINT'] = True
+        AtlassianConnect(app, client_class=_TestClient)
+        health = json.loads(app.test_client().get(
+            '/atlassian_connect/health').get_data())
+        self.assertEqual({'status': 'ok', 'store': None}, health)
+
+    def test_health_opt_in(self):
+        """The endpoint is only served when asked for"""
+        app = Flask("app")
+        AtlassianConnect(app, client_class=_TestClient)
+        self.assertEqual(
+            404, app.test_client().get('/atlassian_connect/health').status_code)
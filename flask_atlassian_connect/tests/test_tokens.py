@@ -0,0 +1,84 @@
+import unittest
+import jwt
+from atlassian_jwt.encode import encode_token
+from jwt.exceptions import (DecodeError, ExpiredSignatureError,
+                            InvalidAlgorithmError, InvalidAudienceError)
+from ..tokens import TokenContext, TokenContextCache, unverified_claims
+
+
+class TokenContextTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.context = TokenContext('client', 'myscret')
+
+    def test_compatible_with_pyjwt(self):
+        """Tokens go both ways between PyJWT and the context"""
+        token = self.context.encode_token('GET', '/some/path?a=1')
+        claims = jwt.decode(token, 'myscret', audience='client',
+                            algorithms=['HS256'])
+        self.assertEqual('client', claims['iss'])
+
+        token = encode_token('GET', '/some/path?a=1', 'client', 'myscret')
+        self.assertEqual(
+            claims['qsh'], self.context.decode(token, audience='client')['qsh'])
+        self.assertEqual(claims['qsh'], unverified_claims(token)['qsh'])
+
+    def test_wrong_secret(self):
+        token = encode_token('GET', '/', 'client', 'other secret')
+        with self.assertRaises(DecodeError):
+            self.context.decode(token, audience='client')
+
+    def test_rejects_other_algorithms(self):
+        token = jwt.encode({'iss': 'client'}, None, algorithm='none')
+        with self.assertRaises(InvalidAlgorithmError):
+            self.context.decode(token)
+        token = jwt.encode({'iss': 'client'}, 'myscret', algorithm='HS512')
+        with self.assertRaises(InvalidAlgorithmError):
+            self.context.decode(token)
+        self.context.decode(token, verify_aud=False, algorithms=['HS512'])
+
+    def test_garbage(self):
+        with self.assertRaises(DecodeError):
+            self.context.decode('not.a-token')
+        with self.assertRaises(DecodeError):
+            self.context.decode(self.context.encode(['not', 'a', 'dict']))
+        with self.assertRaises(DecodeError):
+            self.context.decode(self.context.encode({'exp': 'soon'}))
+
+    def test_claims(self):
+        token = self.context.encode_token('GET', '/', timeout_secs=-60)
+        with self.assertRaises(ExpiredSignatureError):
+            self.context.decode(token, audience='client')
+        self.context.decode(token, audience='client', leeway=120)
+
+        token = self.context.encode_token('GET', '/')
+        with self.assertRaises(InvalidAudienceError):
+            self.context.decode(token, audience='someone else')
+        with self.assertRaises(InvalidAudienceError):
+            self.context.decode(token)
+        self.context.decode(token, verify_aud=False)
+
+
+class TokenContextCacheTestCase(unittest.TestCase):
+    """Test Case"""
+    def test_reuse_and_rotation(self):
+        cache = TokenContextCache(maxsize=2)
+        context = cache.get('client', 'secret')
+        self.assertIs(context, cache.get('client', 'secret'))
+
+        rotated = cache.get('client', 'new secret')
+        self.assertIsNot(context, rotated)
+        self.assertEqual('new secret', rotated.shared_secret)
+
+        cache.invalidate('client')
+        self.assertEqual(0, len(cache))
+
+    def test_bounded(self):
+        cache = TokenContextCache(maxsize=2)
+        for i in range(5):
+            cache.get('client%d' % i, 'secret')
+        self.assertEqual(2, len(cache))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+"""
+HS256 JWT signing with per tenant keyed HMAC state.
+
+A :py:class:`TokenContext` encodes the shared secret and computes the keyed
+HMAC state once per tenant. Tokens are signed by copying that state, which
+saves PyJWT's per call key preparation and header handling.
+
+Verification is plain ``jwt.decode`` and costs the same as before: keying
+the HMAC is a small part of it next to PyJWT's parsing and claim checks,
+which are kept exactly as they are.
+"""
+import base64
+import hashlib
+import hmac
+import json
+from time import time
+
+import jwt
+
+from .cache import LRUCache
+from .canonical import query_string_hash
+
+_HEADER = base64.urlsafe_b64encode(
+    b'{"typ":"JWT","alg":"HS256"}').rstrip(b'=')
+
+
+def unverified_claims(token):
+    """Claims of a token without checking its signature"""
+    return jwt.decode(token, verify=False, options={'verify_signature': False})
+
+
+def _now():
+    return int(time())
+
+
+class TokenContext(object):
+    """
+    Signing and verification for a single tenant
+
+    :ivar client_key: clientKey the context belongs to
+    :ivar shared_secret: sharedSecret the key was prepared from
+    """
+    __slots__ = ('client_key', 'shared_secret', '_key', '_hmac')
+
+    def __init__(self, client_key, shared_secret):
+        self.client_key = client_key
+        self.shared_secret = shared_secret
+        key = shared_secret
+        if not isinstance(key, bytes):
+            key = key.encode('utf8')
+        self._key = key
+        self._hmac = hmac.new(key, digestmod=hashlib.sha256)
+
+    def _signature(self, signing_input):
+        mac = self._hmac.copy()
+        mac.update(signing_input)
+        return mac.digest()
+
+    def encode(self, payload):
+        """Sign the payload, returning the token as a string"""
+        signing_input = _HEADER + b'.' + base64.urlsafe_b64encode(
+            json.dumps(payload, separators=(',', ':')).encode('utf8')
+        ).rstrip(b'=')
+        return (signing_input + b'.' + base64.urlsafe_b64encode(
+            self._signature(signing_input)).rstrip(b'=')).decode('ascii')
+
+    def encode_token(self, http_method, url, timeout_secs=60 * 60):
+        """Same as atlassian_jwt.encode_token for this tenant"""
+        return self.encode_tokens([(http_method, url)], timeout_secs)[0]
+
+    def encode_tokens(self, requests, timeout_secs=60 * 60, issuer=None):
+        """
+        Tokens for many (http_method, url) pairs, sharing one set of claims
+
+        :param issuer:
+            ``iss`` of the tokens. Defaults to the clientKey (also the
+            ``aud``) for requests to the addon itself, requests to the
+            product have to be issued by the addon key instead.
+
+        :rtype: list
+        """
+        now = _now()
+        claims = {
+            'exp': now + timeout_secs,
+            'iat': now,
+            'iss': issuer or self.client_key,
+        }
+        if issuer is None:
+            claims['aud'] = self.client_key
+        tokens = []
+        for http_method, url in requests:
+            claims['qsh'] = query_string_hash(http_method, url)
+            tokens.append(self.encode(claims))
+        return tokens
+
+    def decode(self, token, audience=None, leeway=0, verify_aud=True,
+               algorithms=('HS256',)):
+        """
+        Verify the signature and registered claims of a token with
+        jwt.decode, raising the same exceptions
+
+        :returns: claims
+        :rtype: dict
+        """
+        return jwt.decode(token, self._key, algorithms=list(algorithms),
+                          audience=audience, leeway=leeway,
+                          options={'verify_aud': verify_aud})
+
+
+class TokenContextCache(object):
+    """
+    :py:class:`TokenContext` per clientKey, bounded to the most recently
+    used tenants. A context is replaced whenever the shared secret it was
+    built from no longer matches the client's.
+    """
+    def __init__(self, maxsize=10000):
+        self._contexts = LRUCache(maxsize)
+
+    def get(self, client_key, shared_secret):
+        """Context for the tenant, rebuilt if the secret was rotated"""
+        context = self._contexts.get(client_key)
+        if context is None or context.shared_secret != shared_secret:
+            context = TokenContext(client_key, shared_secret)
+            self._contexts.set(client_key, context)
+        return context
+
+    def invalidate(self, client_key):
+        """Forget the tenant's context, eg after a new install"""
+        self._contexts.pop(client_key)
+
+    def __len__(self):
+        return len(self._contexts)
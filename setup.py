@@ -29,12 +29,15 @@ setup(
     include_package_data=True,
     platforms='any',
     install_requires=io.open('requirements/runtime.txt').readlines(),
+    extras_require={'encryption': ['cryptography']},
     setup_requires=['pytest-runner'],
     keywords=['atlassian connect', 'flask', 'jira', 'confluence'],
     tests_require=[x for x in io.open(
         'requirements/dev.txt').readlines() if not x.startswith('-')],
+    python_requires='>=3.7',
     classifiers=[
-        "Programming Language :: Python :: 2.7",
+        "Programming Language :: Python :: 3",
+        "Programming Language :: Python :: 3 :: Only",
         "Programming Language :: Python :: Implementation :: PyPy",
         'Development Status :: 4 - Beta',
         'Environment :: Web Environment',